@@ -0,0 +1,105 @@
+"""
+extract the answer from verbose outputs of the LLMs ("正解は3と5です", "答え：ＡＣ", {"answer": "AC"}), used when scoring with fix_format
+"""
+
+import re
+import json
+import unicodedata
+
+JSON_PATTERN = re.compile(r'\{.*?\}|\[.*?\]', re.DOTALL)
+JSON_KEYS = ["answer", "pred", "prediction", "回答", "解答", "正解", "答え"]
+# the text after "正解は", "答え：", "Answer:" ... up to the end of the sentence
+MARKER_PATTERN = re.compile(r'(?:正解|答え|回答|解答|answer)\s*(?:は|:|=|is)?\s*(?P<span>[^。\n]*)', re.IGNORECASE)
+# letter choices: a run of up to 5 capital letters (AC) or a single lower case letter, not part of a word nor the pronoun I
+LETTER_PATTERN = re.compile(r'(?<![A-Za-z])(?!I [a-z])(?:[A-Z]{1,5}|[a-z])(?![A-Za-z])')
+NUMBER_PATTERN = re.compile(r'\d+')
+# what can join the choices of one answer, "3と5", "A, C", "b and d"
+SEPARATOR_PATTERN = re.compile(r'\s*(?:,|、|・|/|&|と|および|及び|and)?\s*')
+# an output that is already only choices (e.g. "AC", "1, 3", "2と4") is kept as it is. words such as "Answer C" or "I think B" are not,
+# nor is "and", which normalize_answer would keep as letters
+CLEAN_CHOICE = r'(?:(?<![A-Za-z])(?:[A-Z]{1,5}|[a-z])(?![A-Za-z])|\d+)'
+CLEAN_PATTERN = re.compile(rf'^\s*{CLEAN_CHOICE}(?:\s*(?:,|、|・|/|&|と|および|及び)?\s*{CLEAN_CHOICE})*\s*$')
+
+
+def answer_style(correct_answer):
+    """letter or number, the style of the choices of a question (LETTER_EXPLAIN_PROMPT or NUMBER_EXPLAIN_PROMPT) from its normalized answer.
+    numeric free-response answers are also number. None if the question has no answer"""
+    if correct_answer == "":
+        return None
+    return "letter" if correct_answer[0].isalpha() else "number"
+
+
+def _json_answer(text):
+    for match in JSON_PATTERN.finditer(text):
+        try:
+            value = json.loads(match.group())
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            for key in JSON_KEYS:
+                if key in value:
+                    value = value[key]
+                    break
+            else:
+                continue
+        if isinstance(value, list):
+            value = "".join(str(item) for item in value)
+        return str(value)
+    return None
+
+
+def _first_run(text, patterns):
+    """the choices from the first one in text up to the first thing that is neither a choice nor a separator, e.g. 3 in "3. 理由：1は誤り"
+    Args:
+        text (str): the text after the marker
+        patterns (re.Pattern[]): the patterns of the choices, the one matching first is used for the whole run
+    """
+    matches = [match for match in (pattern.search(text) for pattern in patterns) if match is not None]
+    if not matches:
+        return []
+    match = min(matches, key=lambda match: match.start())
+    choices = [match.group()]
+    while True:
+        separator = SEPARATOR_PATTERN.match(text, match.end())
+        match = match.re.match(text, separator.end())
+        if match is None:
+            return choices
+        choices.append(match.group())
+
+
+def extract_answer(pred, style):
+    """the choices (or the number) in an output of an LLM
+    Args:
+        pred (str): the raw output
+        style (str): letter, number or None to accept both
+    Returns:
+        answer (str): the extracted answer, or pred itself if it is already clean or nothing was found
+    """
+    text = unicodedata.normalize("NFKC", pred).strip()
+    if CLEAN_PATTERN.match(text):
+        return pred
+
+    patterns = {"letter": [LETTER_PATTERN], "number": [NUMBER_PATTERN]}.get(style, [LETTER_PATTERN, NUMBER_PATTERN])
+    json_answer = _json_answer(text)
+    marker = MARKER_PATTERN.search(text) if json_answer is None else None
+    if marker is not None and marker.group("span").strip():
+        # only the answer itself, the explanation after it can mention other choices
+        choices = _first_run(marker.group("span"), patterns)
+    else:
+        text = json_answer if json_answer is not None else text
+        choices = [choice for pattern in patterns for choice in pattern.findall(text)]
+    return "".join(choices) if choices else pred
+
+
+def extract_answers(preds, styles):
+    """extract the answers of a whole prediction file
+    Args:
+        preds (str[]): the raw outputs
+        styles (str[]): the style of each question, see answer_style
+    Returns:
+        answers (str[]): the extracted answers
+        n_repaired (int): the number of outputs that were changed
+    """
+    answers = [extract_answer(pred, style) for pred, style in zip(preds, styles)]
+    n_repaired = sum(answer is not pred for answer, pred in zip(answers, preds))
+    return answers, n_repaired
@@ -0,0 +1,70 @@
+"""
+compare the order the requests of an inference run are sent in, as given (interleaving the exams) or grouped by system prefix by scheduler.PrefixScheduler,
+against mock_server.py simulating a server that keeps the KV cache of a few system messages
+
+    python benchmarks/prefix_scheduling.py --questions 40 --max_concurrency 16
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exam_rules import EXAM_RULES
+from inference import InferenceClient, build_messages
+from mock_server import serve
+from scheduler import ScheduledRequest, PrefixScheduler
+
+
+def synthetic_questions(exam, n, rng):
+    """questions of random length with the choices of the exam, 医師 and 歯科 use letters"""
+    keys = "abcde" if exam in ("医師", "歯科") else "12345"
+    return [{
+        "index": str(i + 1),
+        "question": "問" * rng.randint(20, 400),
+        **{key: "選択肢" * rng.randint(1, 20) for key in keys},
+    } for i in range(n)]
+
+
+def interleaved_requests(n_questions, seed=0):
+    """one question of each exam in turn, the order a runner reading all the exams at once would send"""
+    rng = random.Random(seed)
+    per_exam = [[ScheduledRequest(build_messages(exam, problem), (exam, problem["index"])) for problem in synthetic_questions(exam, n_questions, rng)]
+                for exam in EXAM_RULES]
+    return [requests[i] for i in range(n_questions) for requests in per_exam]
+
+
+async def measure(requests, scheduler, args):
+    server = serve(latency=args.latency, prefill_latency=args.prefill_latency, prefix_cache_size=args.prefix_cache_size)
+    client = InferenceClient(f"http://127.0.0.1:{server.server_port}/v1", "mock", max_concurrency=args.max_concurrency)
+    start = time.perf_counter()
+    await scheduler.run(client, requests, lambda request, content, error: None)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    handler = server.RequestHandlerClass
+    return {"seconds": elapsed, "requests": handler.n_requests, "prefix_hits": handler.prefix_hits, "prefix_switches": scheduler.prefix_switches()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the prefix-aware request order against a mock server")
+    parser.add_argument("--questions", type=int, default=40, help="the questions per exam")
+    parser.add_argument("--max_concurrency", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=None)
+    parser.add_argument("--latency", type=float, default=0.02, help="the seconds of every reply")
+    parser.add_argument("--prefill_latency", type=float, default=0.01, help="the seconds per 1000 characters of a system message missing from the prefix cache")
+    parser.add_argument("--prefix_cache_size", type=int, default=2, help="the system messages the mock server keeps")
+    parser.add_argument("--show", type=int, default=12, help="the number of dispatched requests to print for each order")
+    args = parser.parse_args()
+
+    requests = interleaved_requests(args.questions)
+    for name, prefix_aware in [("as given", False), ("prefix-aware", True)]:
+        scheduler = PrefixScheduler(args.max_concurrency, args.batch_size, prefix_aware)
+        result = asyncio.run(measure(requests, scheduler, args))
+        print(f"{name}: {result['seconds']:.2f}s for {result['requests']} requests, {result['prefix_hits'] / result['requests']:.1%} prefix cache hits, "
+              f"{result['prefix_switches']} prefix switches")
+        if args.show:
+            print("    first dispatched: " + ", ".join(f"{request.tag[0]}:{request.length}" for request in scheduler.dispatched[:args.show]))
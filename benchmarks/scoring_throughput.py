@@ -0,0 +1,239 @@
+"""
+how the scoring scales with the number of models: generate synthetic exams/JA and results/ trees, time each stage of the scoring
+(load, normalize, score, write) and the end-to-end sweep of both engines, and compare against a JSON baseline
+
+    python benchmarks/scoring_throughput.py --models 50 --save_baseline
+    python benchmarks/scoring_throughput.py --models 50                   # exits with 1 if a timing regressed beyond --tolerance
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exam_rules import EXAM_RULES
+from utils import TEST_TYPE_MAP, normalize_answer
+from calculate_scores import YEARS, Scoring, build_test_result, write_total_scores, score_all, score_all_vectorized
+from ground_truth import GroundTruthIndex
+from predictions import load_predictions, PREDICTIONS_JSONL
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scoring_baseline.json")
+SUBJECTS = ["物理", "化学", "生物", "衛生", "薬理", "薬剤", "病態", "法規", "実務"]
+# the questions per section of the real exams, roughly
+QUESTIONS = {"医師": 75, "歯科": 90, "薬剤": 60, "看護": 120, "保健": 55, "理学": 100, "作業": 100, "助産": 55, "診療": 100, "視能": 75}
+
+
+def synthetic_exam(exam, n_questions, rng):
+    """the questions of one section with the fields the scoring reads: forbidden choices for 医師 and 歯科, subjects for 薬剤"""
+    keys = "abcde" if exam in ("医師", "歯科") else "12345"
+    questions = []
+    for i in range(1, n_questions + 1):
+        answer = "".join(sorted(rng.sample(keys, rng.choice([1, 1, 1, 2]))))
+        if exam in ("医師", "歯科"):
+            answer = answer.upper()
+        problem = {
+            "index": str(i),
+            "question": "問" * rng.randint(20, 200),
+            **{key: "選択肢" for key in keys},
+            "answer": answer if rng.random() > 0.01 else "", # a few questions excluded from the scoring
+            "points": rng.choice([1, 1, 3]) if exam in ("医師", "歯科") else rng.choice([1, 2, 3]),
+            "text_only": rng.random() < 0.8,
+            "human_accuracy": round(rng.uniform(20, 100), 1),
+        }
+        if exam in ("医師", "歯科"):
+            problem["kinki"] = rng.choice(["", "", "", "", keys[rng.randrange(5)].upper()])
+        if exam == "薬剤":
+            problem["answer_sub2"] = rng.choice(SUBJECTS)
+        questions.append(problem)
+    return questions
+
+
+def synthetic_pred(problem, accuracy, rng):
+    """a prediction in the formats the models actually write"""
+    if rng.random() < accuracy:
+        return rng.choice([problem["answer"], problem["answer"].lower(), ",".join(problem["answer"]), problem["answer"].translate(str.maketrans("ABCDE12345", "ＡＢＣＤＥ１２３４５"))])
+    return rng.choice(["A", "BC", "1", "24", "", "e", "ｃ"])
+
+
+def generate(root, n_models, questions_scale=1.0, samples=1, seed=0):
+    """write root/exams/JA and root/results with n_models models
+    Args:
+        root (str): the directory to write the trees to
+        n_models (int): the number of (company, model, input_type) combinations
+        questions_scale (float): the questions per section relative to the real exams
+        samples (int): 1 writes the per-section json arrays, more writes one predictions.jsonl per model with this many samples per question
+        seed (int): the seed of the generator
+    Returns:
+        n_questions (int): the questions of all the exams and years, scored once per model
+    """
+    rng = random.Random(seed)
+    data_dir = os.path.join(root, "exams", "JA")
+    exams = {}
+    for exam in TEST_TYPE_MAP:
+        os.makedirs(os.path.join(data_dir, exam), exist_ok=True)
+        for year in YEARS:
+            for section in EXAM_RULES[exam]["sections"]:
+                questions = synthetic_exam(exam, max(1, round(QUESTIONS[exam] * questions_scale)), rng)
+                exams[(exam, year, section)] = questions
+                with open(os.path.join(data_dir, exam, f"{exam}_{year}_{section.lower()}.json"), "w") as f:
+                    json.dump(questions, f, ensure_ascii=False)
+
+    for m in range(n_models):
+        answer_res_path = os.path.join(root, "results", f"company{m % 10}", f"model{m}", "text")
+        accuracy = rng.uniform(0.3, 0.95)
+        if samples > 1:
+            os.makedirs(answer_res_path, exist_ok=True)
+            with open(os.path.join(answer_res_path, PREDICTIONS_JSONL), "w") as f:
+                for (exam, year, section), questions in exams.items():
+                    for problem in questions:
+                        for sample in range(samples):
+                            f.write(json.dumps({"test_type": exam, "year": year, "section": section.lower(), "index": problem["index"],
+                                                "sample": sample, "pred": synthetic_pred(problem, accuracy, rng)}, ensure_ascii=False) + "\n")
+            continue
+        for (exam, year, section), questions in exams.items():
+            os.makedirs(os.path.join(answer_res_path, exam), exist_ok=True)
+            with open(os.path.join(answer_res_path, exam, f"{exam}_{year}_{section.lower()}_pred.json"), "w") as f:
+                json.dump([{"index": problem["index"], "pred": synthetic_pred(problem, accuracy, rng)} for problem in questions], f, ensure_ascii=False)
+    return sum(len(questions) for questions in exams.values())
+
+
+def time_stages(root, score_dir):
+    """the seconds of each stage of Scoring for all the models, one model at a time in this process"""
+    data_dir = os.path.join(root, "exams", "JA")
+    res_dir = os.path.join(root, "results")
+    timings = dict.fromkeys(["load_ground_truth", "load_predictions", "normalize", "score", "write"], 0.0)
+
+    start = time.perf_counter()
+    ground_truth = GroundTruthIndex(data_dir)
+    for exam in TEST_TYPE_MAP:
+        for year in YEARS:
+            for section in EXAM_RULES[exam]["sections"]:
+                ground_truth.get(exam, year, section)
+    timings["load_ground_truth"] = time.perf_counter() - start
+
+    scoring = Scoring(res_dir, score_dir, data_dir)
+    scoring.ground_truth = ground_truth
+    for company in sorted(os.listdir(res_dir)):
+        for model in sorted(os.listdir(os.path.join(res_dir, company))):
+            answer_res_path = os.path.join(res_dir, company, model, "text")
+            save_path = os.path.join(score_dir, company, model, "text")
+            for exam in TEST_TYPE_MAP:
+                os.makedirs(os.path.join(save_path, exam), exist_ok=True)
+                test_results = []
+                for year in YEARS:
+                    start = time.perf_counter()
+                    answer_data = {section: load_predictions(answer_res_path, exam, year, section) for section in EXAM_RULES[exam]["sections"]}
+                    timings["load_predictions"] += time.perf_counter() - start
+
+                    # the first pass fills the cache of normalize_answer, scoring then hits it as it does in a real run
+                    start = time.perf_counter()
+                    for preds in answer_data.values():
+                        for record in preds:
+                            normalize_answer(record["pred"])
+                    timings["normalize"] += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    total_score, pass_or_not, failed_by_forbidden, history = scoring.score_predictions(exam, year, answer_data)
+                    test_results.append(build_test_result(exam, year, total_score, pass_or_not, failed_by_forbidden))
+                    timings["score"] += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    for section, history_data in history.items():
+                        with open(os.path.join(save_path, exam, f"{exam}_{year}_{section.lower()}_history.json"), "w") as f:
+                            json.dump(history_data, f, indent=4, ensure_ascii="must_section" not in EXAM_RULES[exam])
+                    timings["write"] += time.perf_counter() - start
+                start = time.perf_counter()
+                write_total_scores(test_results, os.path.join(save_path, exam, "total_scores.csv"))
+                timings["write"] += time.perf_counter() - start
+    return timings
+
+
+def time_end_to_end(root, score_dir, num_workers):
+    """the seconds of the whole sweep with each engine"""
+    data_dir = os.path.join(root, "exams", "JA")
+    res_dir = os.path.join(root, "results")
+    timings = {}
+    start = time.perf_counter()
+    score_all(res_dir, os.path.join(score_dir, "loop"), data_dir, num_workers=num_workers)
+    timings["end_to_end_loop"] = time.perf_counter() - start
+    start = time.perf_counter()
+    score_all_vectorized(res_dir, os.path.join(score_dir, "vectorized"), data_dir)
+    timings["end_to_end_vectorized"] = time.perf_counter() - start
+    return timings
+
+
+def compare(results, baseline, tolerance):
+    """the timings slower than the baseline by more than tolerance, [] if the configurations differ"""
+    if baseline["config"] != results["config"]:
+        print(f"The baseline was recorded with {baseline['config']}, not comparing")
+        return []
+    regressions = []
+    for name, seconds in results["seconds"].items():
+        before = baseline["seconds"].get(name)
+        if before is None:
+            continue
+        change = seconds / max(before, 1e-9) - 1
+        print(f"{name:24s} {before:9.3f}s -> {seconds:9.3f}s ({change:+.1%})")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the scoring throughput on synthetic exams and results")
+    parser.add_argument("--models", type=int, default=20)
+    parser.add_argument("--questions_scale", type=float, default=1.0, help="the questions per section relative to the real exams")
+    parser.add_argument("--samples", type=int, default=1, help="more than 1 writes predictions.jsonl files with this many samples per question")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="the workers of the end-to-end sweep of score_all")
+    parser.add_argument("--root", type=str, default=None, help="the directory to generate the trees in, a temporary one by default")
+    parser.add_argument("--skip_stages", action="store_true", help="only time the end-to-end sweeps")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH)
+    parser.add_argument("--save_baseline", action="store_true", help="record these timings as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="the slowdown against the baseline reported as a regression")
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix="scoring_benchmark_")
+    try:
+        start = time.perf_counter()
+        n_questions = generate(root, args.models, args.questions_scale, args.samples, args.seed)
+        print(f"Generated {args.models} models x {n_questions} questions in {time.perf_counter() - start:.1f}s at {root}")
+
+        seconds = {}
+        if not args.skip_stages:
+            seconds.update(time_stages(root, os.path.join(root, "scoring_stages")))
+        seconds.update(time_end_to_end(root, os.path.join(root, "scoring"), args.num_workers))
+    finally:
+        if args.root is None:
+            shutil.rmtree(root)
+
+    results = {
+        "config": {"models": args.models, "questions_scale": args.questions_scale, "samples": args.samples, "seed": args.seed,
+                   "num_workers": args.num_workers, "skip_stages": args.skip_stages},
+        "machine": {"python": platform.python_version(), "processor": platform.machine(), "cpus": os.cpu_count()},
+        "seconds": seconds,
+        "questions_per_second": {name: args.models * n_questions / max(value, 1e-9) for name, value in seconds.items()
+                                 if name.startswith("end_to_end") or name in ("score", "normalize")},
+    }
+    for name, value in seconds.items():
+        print(f"{name:24s} {value:9.3f}s")
+    for name, value in results["questions_per_second"].items():
+        print(f"{name:24s} {value:12,.0f} questions/s")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Saved the baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,208 @@
+"""
+how robust the verdict of each model is: bootstrap confidence intervals of the sub scores and the probability of passing under the rules of each exam.
+the questions of each sub score are resampled with replacement, and every model is scored on the same resamples at once with NumPy
+
+    python bootstrap.py --n_resamples 2000
+"""
+
+import os
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from tqdm import tqdm
+from utils import TEST_TYPE_MAP
+from exam_rules import YEARS
+from calculate_scores import list_model_dirs, select_combos, write_total_scores, parse_years
+from manifest import read_total_scores
+from vectorized_scoring import VectorizedScoring, judge_arrays
+
+BOOTSTRAP_FILE = "bootstrap.csv"
+
+
+def resample_weights(groups, n_resamples, rng):
+    """how many times each question is drawn in each resample, the questions of each sub score are drawn as many times as there are of them
+    Args:
+        groups (np.ndarray): the sub score of each question, shape (questions,)
+        n_resamples (int): the number of resamples
+        rng (np.random.Generator): the random generator
+    Returns:
+        weights (np.ndarray): shape (resamples, questions)
+    """
+    weights = np.zeros((n_resamples, len(groups)), dtype=np.int64)
+    for group in np.unique(groups):
+        members = np.flatnonzero(groups == group)
+        weights[:, members] = rng.multinomial(len(members), np.full(len(members), 1 / len(members)), size=n_resamples)
+    return weights
+
+
+def bootstrap_exam(engine, exam, year, answer_res_paths, n_resamples=1000, alpha=0.05, seed=0, fix_format=False):
+    """the bootstrap of one exam and year for several LLMs
+    Args:
+        engine (VectorizedScoring): the scoring engine
+        exam (str): the type of the exam
+        year (int): the year of the exam
+        answer_res_paths (str[]): the paths to the answers of the LLMs
+        n_resamples (int): the number of resamples
+        alpha (float): 1 - the confidence level of the intervals
+        seed (int): the seed of the resamples, the same seed gives the same resamples for every model
+        fix_format (bool): if True, extract the answer from verbose outputs before scoring, as calculate_scores.py --fix_format
+    Returns:
+        rows (dict[]): one row of bootstrap.csv per LLM, None for the LLMs whose predictions could not be read
+        errors (dict): the position of each of those LLMs in answer_res_paths -> traceback
+    """
+    plan = engine.plan(exam, year)
+    gold = engine.gold_arrays(exam, year)
+    # one model at a time, so that a broken prediction file only leaves out its own model
+    columns = []
+    errors = {}
+    for j, answer_res_path in enumerate(answer_res_paths):
+        try:
+            columns.append(engine.load_predictions([answer_res_path], exam, year, fix_format))
+        except Exception:
+            errors[j] = traceback.format_exc()
+    loaded = [j for j in range(len(answer_res_paths)) if j not in errors]
+    rows = [None] * len(answer_res_paths)
+    if not loaded:
+        return rows, errors
+    result = engine.evaluate(exam, year, np.concatenate(columns, axis=1))
+    earned = result["correct"] * gold["points"][:, None] # (questions, models)
+
+    rng = np.random.default_rng([seed, list(TEST_TYPE_MAP).index(exam), int(year)])
+    weights = resample_weights(gold["groups"], n_resamples, rng) # (resamples, questions)
+
+    # every array below has the trailing axes (resamples, models)
+    sub_scores = np.stack([weights[:, gold["groups"] == group] @ earned[gold["groups"] == group] for group in range(plan.n_groups)])
+    forbidden = weights @ result["forbidden_choices"].astype(np.int64)
+    area_score = area_total = None
+    if plan.has_areas:
+        area_total = np.stack([weights[:, gold["area_ids"] == area] @ earned[gold["area_ids"] == area] for area in range(len(plan.areas))])
+        not_must = gold["not_must"]
+        area_score = np.stack([weights[:, (gold["area_ids"] == area) & not_must] @ earned[(gold["area_ids"] == area) & not_must] for area in range(len(plan.areas))])
+    pass_or_not, _ = judge_arrays(plan, sub_scores, forbidden, area_score, area_total)
+
+    scores = {"total_score": (result["sub_scores"].sum(axis=0), sub_scores.sum(axis=0))}
+    if plan.n_groups > 1:
+        for group in range(plan.n_groups):
+            scores[f"sub_score_{group}"] = (result["sub_scores"][group], sub_scores[group])
+
+    for k, j in enumerate(loaded):
+        row = {"test_type": exam, "year": year}
+        for name, (point, resampled) in scores.items():
+            low, high = np.quantile(resampled[:, k], [alpha / 2, 1 - alpha / 2])
+            row.update({name: int(point[k]), f"{name}_low": float(low), f"{name}_high": float(high)})
+        row["pass_or_not"] = bool(result["pass_or_not"][k])
+        row["pass_probability"] = float(pass_or_not[:, k].mean())
+        rows[j] = row
+    return rows, errors
+
+
+# the engine of a worker process, created once by _init_worker
+_worker_engine = None
+
+
+def _init_worker(data_dir, cache_dir=None, exam_store=None, sample=0):
+    global _worker_engine
+    _worker_engine = VectorizedScoring(data_dir, cache_dir, exam_store, sample)
+
+
+def _bootstrap_unit(exam, year, answer_res_paths, n_resamples, alpha, seed, fix_format):
+    try:
+        return (exam, year), *bootstrap_exam(_worker_engine, exam, year, answer_res_paths, n_resamples, alpha, seed, fix_format), None
+    except Exception:
+        return (exam, year), None, {}, traceback.format_exc()
+
+
+def bootstrap_all(res_dir, score_dir, data_dir, combos=None, n_resamples=1000, alpha=0.05, seed=0, num_workers=None, cache_dir=None, exam_store=None, sample=0,
+                  fix_format=False, exams=None, years=None):
+    """write score_dir/<company>/<model>/<input_type>/<exam>/bootstrap.csv for every model, the (exam, year) units run over a process pool
+    Args:
+        res_dir (str): the path to the result of the LLMs
+        score_dir (str): the path to save the scoring result
+        data_dir (str): the path to the ground truth data
+        combos (list): the (company, model, input_type) combinations, defaults to all in res_dir
+        n_resamples (int): the number of resamples
+        alpha (float): 1 - the confidence level of the intervals
+        seed (int): the seed of the resamples
+        num_workers (int): the number of worker processes, defaults to the number of cores. 1 runs in this process
+        cache_dir (str): the path to cache the parsed ground truth across runs
+        exam_store (str): the path to the exam store to read the ground truth from, see exam_store.py
+        sample (int): the sample to bootstrap when the JSONL predictions have several samples per question
+        fix_format (bool): if True, extract the answer from verbose outputs before scoring, as calculate_scores.py --fix_format
+        exams (str[]): the exams to bootstrap, defaults to all
+        years (int[]): the years to bootstrap, defaults to YEARS. the rows of the other years in bootstrap.csv are kept
+    Returns:
+        failures (list): ((exam, year), traceback) of the units that failed and ((company, model, input_type, exam, year), traceback)
+            of the models whose predictions could not be read, the other models of the unit are written anyway and the failed ones keep their
+            row of the previous run
+    """
+    if combos is None:
+        combos = list_model_dirs(res_dir)
+    answer_res_paths = [os.path.join(res_dir, *combo) for combo in combos]
+    units = [(exam, year) for exam in (list(TEST_TYPE_MAP) if exams is None else exams) for year in (YEARS if years is None else years)]
+
+    results = []
+    if num_workers == 1:
+        _init_worker(data_dir, cache_dir, exam_store, sample)
+        for exam, year in tqdm(units):
+            results.append(_bootstrap_unit(exam, year, answer_res_paths, n_resamples, alpha, seed, fix_format))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(data_dir, cache_dir, exam_store, sample)) as executor:
+            futures = [executor.submit(_bootstrap_unit, exam, year, answer_res_paths, n_resamples, alpha, seed, fix_format) for exam, year in units]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                results.append(future.result())
+
+    rows = {}
+    failures = []
+    failed = set() # (combo, exam, year) whose row of the previous run is kept
+    for (exam, year), unit_rows, errors, error in results:
+        if error is not None:
+            failures.append(((exam, year), error))
+            failed.update((combo, exam, year) for combo in combos)
+            continue
+        for j, model_error in errors.items():
+            failures.append(((*combos[j], exam, year), model_error))
+            failed.add((combos[j], exam, year))
+        for combo, row in zip(combos, unit_rows):
+            if row is not None:
+                rows.setdefault((combo, exam), []).append(row)
+    for (combo, exam), test_results in sorted(rows.items()):
+        os.makedirs(os.path.join(score_dir, *combo, exam), exist_ok=True)
+        csv_path = os.path.join(score_dir, *combo, exam, BOOTSTRAP_FILE)
+        # the rows of the years not selected and of the years that failed are kept
+        test_results += [row for year, row in read_total_scores(csv_path).items()
+                         if (years is not None and year not in years) or (combo, exam, year) in failed]
+        write_total_scores(test_results, csv_path)
+
+    for unit, error in sorted(failures, key=lambda failure: [str(part) for part in failure[0]]):
+        print(f"Failed to bootstrap {' '.join(str(part) for part in unit)}:\n{error}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="bootstrap confidence intervals and pass probabilities of the LLMs")
+    parser.add_argument("--n_resamples", type=int, default=1000)
+    parser.add_argument("--alpha", type=float, default=0.05, help="1 - the confidence level of the intervals")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="the number of worker processes, 1 to run serially")
+    parser.add_argument("--sample", type=int, default=0, help="the sample to bootstrap when the JSONL predictions have several samples per question")
+    parser.add_argument("--fix_format", action="store_true", help="extract the answer from verbose outputs before scoring, as calculate_scores.py --fix_format")
+    parser.add_argument("--models", type=str, nargs="+", default=None, help="glob patterns of company/model to bootstrap, e.g. openai/gpt-4o* '*/llama*'")
+    parser.add_argument("--input_type", type=str, nargs="+", default=None, help="text and/or multimodal")
+    parser.add_argument("--exams", type=str, nargs="+", default=None, choices=list(TEST_TYPE_MAP), help="the exams to bootstrap, e.g. 医師 薬剤")
+    parser.add_argument("--years", type=parse_years, default=None, help="the years to bootstrap, e.g. 2024, 2022-2024 or 2020,2023")
+    parser.add_argument("--exam_store", type=str, default=None, help="read the ground truth from the SQLite file built by exam_store.py")
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--res_dir", type=str, default="./results")
+    parser.add_argument("--score_dir", type=str, default="./scoring")
+    parser.add_argument("--data_dir", type=str, default="./exams/JA")
+    args = parser.parse_args()
+
+    combos = select_combos(args.res_dir, args.models, args.input_type)
+    if not combos:
+        parser.error(f"No model in {args.res_dir} matches --models {args.models} --input_type {args.input_type}")
+    if args.years is not None and not set(args.years) <= set(YEARS):
+        parser.error(f"--years must be within {YEARS.start}-{YEARS.stop - 1}")
+    bootstrap_all(args.res_dir, args.score_dir, args.data_dir, combos=combos, n_resamples=args.n_resamples, alpha=args.alpha, seed=args.seed,
+                  num_workers=args.num_workers, cache_dir=args.cache_dir, exam_store=args.exam_store, sample=args.sample, fix_format=args.fix_format,
+                  exams=args.exams, years=args.years)
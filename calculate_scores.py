@@ -3,652 +3,218 @@ score the result of the LLMs
 """
 
 import os
-import re
+import csv
+import sys
 import json
+import numbers
+import fnmatch
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from copy import deepcopy
-import pandas as pd
-from tqdm import tqdm
-from utils import TEST_TYPE_MAP
+from utils import TEST_TYPE_MAP, normalize_answer, normalization_stats, encode_answer, choice_mask
+from ground_truth import get_ground_truth_index
+from exam_rules import EXAM_RULES, YEARS, get_plan
+from history_writer import HISTORY_FORMATS, HistoryTableWriter
+from predictions import load_predictions, join_predictions, update_join_report, prediction_files, JOIN_REPORT, PREDICTIONS_JSONL
+from manifest import unit_digest, load_manifest, save_manifest, read_total_scores
+from exam_store import open_store
+from answer_extraction import answer_style, extract_answers
+from results_db import ResultsDatabase
+from metrics import StageMetrics, profiled
+
+# bump when the scoring rules change, so that the incremental mode scores everything again
+SCORING_VERSION = "2"
 
 class Scoring:
-    def __init__(self, res_dir, score_dir, data_dir):
+    def __init__(self, res_dir, score_dir, data_dir, cache_dir=None, history_format="json", export_json=False, sample=0, exam_store=None, collect_outcomes=False,
+                 metrics=False):
         """initialize the scoring class
         Args:
             res_dir (str): the path to the result of the LLMs
             passing_path (str): the path to the csv of metrics for the passing score of tests
             score_dir (str): the path to save the scoring result
             data_dir (str): the path to the ground truth data
+            cache_dir (str): the path to cache the parsed ground truth across runs, None to keep it in memory only
+            history_format (str): json writes one *_history.json per section, parquet or arrow one history table per model and input type
+            export_json (bool): if True, also write the *_history.json files when history_format is parquet or arrow
+            sample (int): the sample to score when the JSONL predictions have several samples per question
+            exam_store (str): the path to the exam store to read the ground truth from instead of the json files in data_dir, see exam_store.py
+            collect_outcomes (bool): if True, keep the outcome of each question in self.outcomes for the results database, see results_db.py
+            metrics (bool): if True, record the time, items and bytes of each stage of each unit in self.metrics, see metrics.py
         """
+        assert history_format in HISTORY_FORMATS, f"Invalid history format: {history_format}"
         self.res_dir = res_dir
         self.score_dir = score_dir
         self.data_dir = data_dir
+        # the ground truth is loaded once per process and shared by all the models
+        self.ground_truth = get_ground_truth_index(data_dir, cache_dir, exam_store)
+        self.history_format = history_format
+        self.export_json = export_json
+        self.sample = sample
+        self.pending_history = [] # (save_path, test_type, history of a section) not yet written to the history table
+        self.history_writers = {} # save_path -> HistoryTableWriter
+        self.join_report = [] # the sections whose predictions did not match the questions one to one
+        self.n_repaired = 0 # the predictions whose answer was extracted from a verbose output with fix_format
+        self.outcomes = [] if collect_outcomes else None # the outcome of each question scored, see results_db.ResultsDatabase.replace_unit
+        self.metrics = StageMetrics(enabled=metrics)
 
     # Helper function to normalize answers
     def normalize_answer(self, answer):
-        # Remove non-alphabetic non-numeric characters, sort the characters, and convert to uppercase. the length of the answer is limited to <6
-        return ''.join(sorted(re.sub(r'[^a-zA-Z0-9]', '', answer))).upper()[:6]
+        return normalize_answer(answer)
 
-    def ishi_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 医師国試
+    def score_predictions(self, test_type, year, answer_data, fix_format=False):
+        """score the answers of an LLM on one exam and year by the rules in exam_rules.EXAM_RULES
         Args:
-            year (str): the year of the exam
-            answer_res_path (str): the path to the answer of the LLM
-            save_path (str): the path to save the scoring result
-            fix_format (bool): if True, fix the format of the answer of the problems
+            test_type (str): the type of the exam, one of the keys of TEST_TYPE_MAP
+            year (int): the year of the exam
+            answer_data (dict): the predictions of each section, {section: [{"index": ..., "pred": ...}, ...]}, see predictions.join_predictions
+            fix_format (bool): if True, extract the answer from verbose outputs before normalizing it, see answer_extraction.py
         Returns:
-            total_score (int[]): the total score of the LLM in the exam, including 必修（B,E） and 一般（A,C,D,F）
+            total_score (int[], int or dict): the sub scores (e.g. 必修 and 一般 of 医師), the total score, or the score record of 薬剤
             pass_or_not (bool): whether the LLM passed the exam
-            failed_by_forbidden (bool): if over 3 forbidden choices were selected, return True
+            failed_by_forbidden (bool): if too many forbidden choices were selected, return True
+            history (dict): the history of each section, {section: [...]}
         """
+        if test_type not in EXAM_RULES:
+            raise ValueError(f"Invalid test type: {test_type}")
+        # the ground truth is read on the first use of each exam and year
+        with self.metrics.stage("load_ground_truth") as timing:
+            bytes_read = self.ground_truth.bytes_read
+            plan = get_plan(test_type, year, self.ground_truth)
+            timing.add(sum(len(questions) for _, questions in plan.sections), self.ground_truth.bytes_read - bytes_read)
+
+        sub_scores = [0] * plan.n_groups
+        area_score = [0] * len(plan.areas) # the score of each subject outside the must section
+        area_total_score = [0] * len(plan.areas) # the score of each subject
+        count_forbidden = 0
+        history = {}
+
+        i = 0 # the position of the question in the plan
+        for section, questions in plan.sections:
+            # match the predictions to the questions by their index
+            with self.metrics.stage("join") as timing:
+                preds, counts = join_predictions(questions, answer_data.get(section, []))
+                if any(counts.values()):
+                    self.join_report.append({"test_type": test_type, "year": year, "section": section, **counts})
+                if fix_format:
+                    preds, n_repaired = extract_answers(preds, [answer_style(problem["answer"]) for problem in questions])
+                    self.n_repaired += n_repaired
+                timing.add(len(preds))
+            with self.metrics.stage("normalize") as timing:
+                answers = [self.normalize_answer(pred) for pred in preds]
+                timing.add(len(answers))
+            with self.metrics.stage("score") as timing:
+                history_data = []
+                for position, (problem, answer) in enumerate(zip(questions, answers)):
+                    correct = plan.valid[i] and encode_answer(answer) == problem["answer_code"]
+                    if correct:
+                        group = plan.groups[i]
+                        sub_scores[group] += problem["points"]
+                        if plan.area_ids[i] >= 0:
+                            area_total_score[plan.area_ids[i]] += problem["points"]
+                            if group != 0: # not the must section
+                                area_score[plan.area_ids[i]] += problem["points"]
+
+                    # check if the answer is forbidden
+                    forbidden = (choice_mask(answer) & problem["kinki_mask"]) != 0
+                    if forbidden:
+                        count_forbidden += 1
+                    if self.outcomes is not None:
+                        self.outcomes.append({"section": section, "position": position, "index": problem["index"], "pred": answer, "answer": problem["answer"],
+                                              "points": problem["points"], "valid": bool(plan.valid[i]), "correct": bool(correct), "forbidden": forbidden})
 
-        # 必修: B、E；一般: A、C、D、F
-        must_sections = ["B", "E"]
-        general_sections = ["A", "C", "D", "F"]
+                    record = {
+                        "year": year,
+                        "section": section,
+                        "index": problem["index"],
+                        "text_only": problem["text_only"],
+                    }
+                    if plan.forbidden_limit is not None:
+                        record["kinki"] = problem["kinki"]
+                    if plan.has_areas:
+                        record["subject"] = problem["subject"]
+                    record.update({
+                        "pred": answer,
+                        "answer": problem["answer"],
+                        "points": problem["points"],
+                        "human_accuracy": problem["human_accuracy"]
+                    })
+                    history_data.append(record)
+                    i += 1
+                history[section] = history_data
+                timing.add(len(history_data))
 
-        pass_score_dict = {
-            "2020": [158, 217], # 必修158, 一般217
-            "2021": [160, 209], # 必修160, 一般209
-            "2022": [158, 214], # 必修158, 一般214
-            "2023": [160, 220], # 必修160, 一般220
-            "2024": [160, 230]  # 必修160, 一般230
-        }
+        total_score, pass_or_not, failed_by_forbidden = plan.judge(sub_scores, count_forbidden, area_score, area_total_score)
+        return total_score, pass_or_not, failed_by_forbidden, history
 
-        total_score = [0, 0] # [必修、一般]
-        count_forbidden = 0
-        pass_or_not = False
-        failed_by_forbidden = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "医師")
-
-        for section in ["B", "E", "A", "C", "D", "F"]:
-            score_index = 0 if section in must_sections else 1 # 0: 必修, 1: 一般
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"医師_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "医師", f"医師_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                if correct_answer != "" and answer == correct_answer:
-                    total_score[score_index] += int(problem["points"])
-                
-                # check if the answer is forbidden
-                for choice in answer:
-                    if choice in problem["kinki"]:
-                        count_forbidden += 1
-                        break
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "kinki": problem["kinki"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "医師", f"医師_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-
-        if count_forbidden > 3:
-            failed_by_forbidden = True
-        
-        if total_score[0] >= pass_score_dict[str(year)][0] and total_score[1] >= pass_score_dict[str(year)][1] and not failed_by_forbidden:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, failed_by_forbidden
-    
-    def shika_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 歯科国試
+    def score(self, test_type, year, answer_res_path, save_path, fix_format=False):
+        """score the result of the LLM on one exam and year and save the history of each section
         Args:
-            year (str): the year of the exam
+            test_type (str): the type of the exam, one of the keys of TEST_TYPE_MAP
+            year (int): the year of the exam
             answer_res_path (str): the path to the answer of the LLM
             save_path (str): the path to save the scoring result
             fix_format (bool): if True, fix the format of the answer of the problems
         Returns:
-            total_score (int[]): the total score of the LLM in the exam, including 必修（B,E） and 一般（A,C,D,F）
+            total_score (int[], int or dict): see score_predictions
             pass_or_not (bool): whether the LLM passed the exam
-            failed_by_forbidden (bool): if over 3 forbidden choices were selected, return True
+            failed_by_forbidden (bool): if too many forbidden choices were selected, return True
         """
+        if test_type not in EXAM_RULES:
+            raise ValueError(f"Invalid test type: {test_type}")
 
-        pass_score_dict = {
-            "2020": [64, 65, 260], # 必修64, 領域A65, 領域B260
-            "2021": [63, 53, 236], # 必修63, 領域A53, 領域B236
-            "2022": [64, 59, 237], # 必修64, 領域A59, 領域B237
-            "2023": [64, 63, 257], # 必修64, 領域A63, 領域B257
-            "2024": [64, 60, 254]  # 必修64, 領域A60, 領域B254
-        }
+        self.metrics.unit = (*os.path.relpath(answer_res_path, self.res_dir).split(os.sep), test_type, year)
 
-        def get_ryouiki(year, section, index):
-            index = int(index.split("-")[0])
-            if index <= 20: # 必修
-                return 0
-            elif index <= 45: # 領域A
-                return 1
-            else:
-                return 2
+        # read the answer of the LLM, from the json arrays or the JSONL files, see predictions.py
+        with self.metrics.stage("load_predictions") as timing:
+            answer_data = {}
+            for section in EXAM_RULES[test_type]["sections"]:
+                answer_data[section] = load_predictions(answer_res_path, test_type, year, section, self.sample)
+            # a predictions.jsonl shared by all the exams is not counted, it is read once per model
+            timing.add(sum(len(preds) for preds in answer_data.values()),
+                       sum(os.path.getsize(path) for path in prediction_files(answer_res_path, test_type, year) if not path.endswith(PREDICTIONS_JSONL)))
 
-        total_score = [0, 0, 0] # [必修、領域A、領域B]
-        count_forbidden = 0
-        pass_or_not = False
-        failed_by_forbidden = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "歯科")
-
-        for section in ["A", "B", "C", "D"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"歯科_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "歯科", f"歯科_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                score_index = get_ryouiki(year, section, problem["index"])
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score[score_index] += int(problem["points"])
-                
-                # check if the answer is forbidden
-                for choice in answer:
-                    if choice in problem["kinki"]:
-                        count_forbidden += 1
-                        break
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "kinki": problem["kinki"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "歯科", f"歯科_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-
-        if count_forbidden > 3:
-            failed_by_forbidden = True
-        
-        if total_score[0] >= pass_score_dict[str(year)][0] and total_score[1] >= pass_score_dict[str(year)][1] and total_score[2] >= pass_score_dict[str(year)][2] and not failed_by_forbidden:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, failed_by_forbidden
+        total_score, pass_or_not, failed_by_forbidden, history = self.score_predictions(test_type, year, answer_data, fix_format)
 
-    def kango_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 看護師国試"""
-        pass_score_dict = {
-            "2020": [40, 155], # 必修40,一般155
-            "2021": [40, 159], # 必修40,一般159
-            "2022": [40, 167], # 必修40,一般167
-            "2023": [40, 152], # 必修40,一般152
-            "2024": [40, 158]  # 必修40,一般158
-        }
+        for section, history_data in history.items():
+            if self.history_format == "json" or self.export_json:
+                with self.metrics.stage("write_history") as timing, open(os.path.join(save_path, test_type, f"{test_type}_{year}_{section.lower()}_history.json"), "w") as f:
+                    # the subjects of 薬剤 are written as they are
+                    json.dump(history_data, f, indent=4, ensure_ascii="must_section" not in EXAM_RULES[test_type])
+                    timing.add(len(history_data), f.tell())
+            if self.history_format != "json":
+                self.pending_history.append((save_path, test_type, history_data))
 
-        def get_ryouiki(index):
-            index = int(index.split("-")[0])
-            if index <= 25: # 必修
-                return 0
-            else: # 一般
-                return 1
-
-        total_score = [0, 0] # [必修、一般]
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "看護")
-
-        for section in ["A", "B"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"看護_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "看護", f"看護_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                score_index = get_ryouiki(problem["index"])
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score[score_index] += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "看護", f"看護_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-        
-        if total_score[0] >= pass_score_dict[str(year)][0] and total_score[1] >= pass_score_dict[str(year)][1]:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, False
-
-    def hoken_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 保健師国試"""
-
-        total_score = 0
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "保健")
-
-        for section in ["A", "B"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"保健_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "保健", f"保健_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "保健", f"保健_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-        
-        if total_score >= 87:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, False
-    
-    def rigaku_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 理学療法士国試"""
-        pass_scores = [168, 43]
-
-        def get_ryouiki(index):
-            index = int(index.split("-")[0])
-            if index <= 80: # 必修
-                return 0
-            else: # 実地
-                return 1
-
-        total_score = [0, 0] # [必修、一般]
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "理学")
-
-        for section in ["A", "B"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"理学_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "理学", f"理学_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                score_index = get_ryouiki(problem["index"])
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score[score_index] += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "理学", f"理学_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-        
-        if total_score[0] >= pass_scores[0] and total_score[1] >= pass_scores[1]:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, False
-    
-    def sagyou_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 作業療法士国試"""
-        pass_scores = [168, 43]
-
-        def get_ryouiki(index):
-            index = int(index.split("-")[0])
-            if index <= 80: # 必修
-                return 0
-            else: # 実地
-                return 1
-
-        total_score = [0, 0] # [必修、一般]
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "作業")
-
-        for section in ["A", "B"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"作業_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "作業", f"作業_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                score_index = get_ryouiki(problem["index"])
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score[score_index] += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "作業", f"作業_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-        
-        if total_score[0] >= pass_scores[0] and total_score[1] >= pass_scores[1]:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, False
-
-    def jyosan_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 助産師国試"""
-        total_score = 0
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "助産")
-
-        for section in ["A", "B"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"助産_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "助産", f"助産_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "助産", f"助産_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-        
-        if total_score >= 87:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, False
-
-    def shinryo_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 診療放射線技師国試"""
-        pass_score = 120
-        total_score = 0
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "診療")
-
-        for section in ["A", "B"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"診療_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "診療", f"診療_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "診療", f"診療_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-        
-        if total_score >= pass_score:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, False
-        
-    def shinou_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 視能訓練士国試"""
-        pass_score = 102
-        total_score = 0
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "視能")
-
-        for section in ["A", "B"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"視能_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "視能", f"視能_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                if correct_answer != "" and "corrected_question_index" not in problem and answer == correct_answer:
-                    total_score += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "視能", f"視能_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4)
-        
-        if total_score >= pass_score:
-            pass_or_not = True
-        
-        return total_score, pass_or_not, False
-    
-    def yakuzai_score(self, year, answer_res_path, save_path, fix_format=False):
-        """score the result of the LLMs on 薬剤師国試"""
-        pass_score_dict = {
-            "2020": 426, # total score
-            "2021": 430, 
-            "2022": 434, 
-            "2023": 470, 
-            "2024": 420,  
-        }
-        must_score_line = 126 # 必修 >70% correct
-        area_score_ratio = 0.3 # each subject >30% correct in must
-
-        total_score = 0
-        must_score = 0
-        area_score = {} # actual score of each subject in must
-        area_total_score = {} # total score of each area
-        pass_or_not = False
-
-        # read the ground truth data (correct answer, points, forbidden choices, etc.)
-        ground_truth_path = os.path.join(self.data_dir, "薬剤")
-
-        for section in ["a1", "a2", "a3", "b1", "b2", "b3"]:
-            # read the ground truth data
-            with open(os.path.join(ground_truth_path, f"薬剤_{year}_{section.lower()}.json"), "r") as f:
-                question_data = json.load(f)
-            
-            # read the answer of the LLM
-            with open(os.path.join(answer_res_path, "薬剤", f"薬剤_{year}_{section.lower()}_pred.json"), "r") as f:
-                answer_data = json.load(f)
-            
-            history_data = []
-            # score the answer of the LLM
-            for i, problem in enumerate(question_data):
-                answer = answer_data[i]["pred"]
-                answer = self.normalize_answer(answer)
-                correct_answer = problem["answer"]
-                correct_answer = self.normalize_answer(correct_answer)
-                if correct_answer != "" and "corrected_question_index" not in problem:
-                    area = problem["answer_sub2"]
-                    if area not in area_score:
-                        area_score[area] = 0
-                        area_total_score[area] = 0
-
-                    if answer == correct_answer:
-                        total_score += int(problem["points"])
-                        area_total_score[area] += int(problem["points"])
-                        if section == "a1": # this is the must section
-                            must_score += int(problem["points"])
-                        else:
-                            area_score[area] += int(problem["points"])
-                
-                history_data.append({
-                    "year": year,
-                    "section": section,
-                    "index": problem["index"],
-                    "text_only": problem["text_only"],
-                    "subject": problem["answer_sub2"],
-                    "pred": answer,
-                    "answer": correct_answer,
-                    "points": int(problem["points"]),
-                    "human_accuracy": problem["human_accuracy"]
-                })
-            with open(os.path.join(save_path, "薬剤", f"薬剤_{year}_{section.lower()}_history.json"), "w") as f:
-                json.dump(history_data, f, indent=4, ensure_ascii=False)
-        
-        if total_score >= pass_score_dict[str(year)] and must_score >= must_score_line and all(area_score[area] >= area_score_ratio * area_total_score[area] for area in area_score):
-            pass_or_not = True
-        
-        score_record = {
-            "total_score": total_score,
-            "must_score": must_score,
-            "area_score": area_score,
-            "area_total_score": area_total_score
-        }
-        return score_record, pass_or_not, False
-            
-    
-    def score(self, test_type, year, answer_res_path, save_path, fix_format=False):
-        if test_type == "医師":
-            return self.ishi_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "歯科":
-            return self.shika_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "看護":
-            return self.kango_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "保健":
-            return self.hoken_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "理学":
-            return self.rigaku_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "作業":
-            return self.sagyou_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "助産":
-            return self.jyosan_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "診療":
-            return self.shinryo_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "視能":
-            return self.shinou_score(year, answer_res_path, save_path, fix_format)
-        elif test_type == "薬剤":
-            return self.yakuzai_score(year, answer_res_path, save_path, fix_format)
-        else:
-            raise ValueError(f"Invalid test type: {test_type}")
+        return total_score, pass_or_not, failed_by_forbidden
+
+    def flush_history(self):
+        """append the pending history to the history table of each model"""
+        for save_path, test_type, history_data in self.pending_history:
+            if save_path not in self.history_writers:
+                self.history_writers[save_path] = HistoryTableWriter(save_path, self.history_format)
+            self.history_writers[save_path].append(test_type, history_data)
+        self.pending_history = []
+
+    def close_history(self):
+        self.flush_history()
+        for writer in self.history_writers.values():
+            writer.close()
+        self.history_writers = {}
+
+    def score_year(self, test_type, year, answer_res_path, save_path, fix_format=False):
+        """score one year of one exam and build its row of total_scores.csv
+        Args:
+            test_type (str): the type of the exam, one of the keys of TEST_TYPE_MAP
+            year (int): the year of the exam
+            answer_res_path (str): the path to the answer of the LLM
+            save_path (str): the path to save the scoring result
+            fix_format (bool): if True, fix the format of the answer of the problems
+        Returns:
+            test_result (dict): the row of total_scores.csv for this exam and year
+        """
+        total_score, pass_or_not, failed_by_forbidden = self.score(test_type, year, answer_res_path, save_path, fix_format)
+        return build_test_result(test_type, year, total_score, pass_or_not, failed_by_forbidden)
 
     def total_scores(self, company, model, input_type, fix_format=False):
         """score the result of the LLMs on all the exams and save the result to a csv file
@@ -662,58 +228,441 @@ class Scoring:
         if not os.path.exists(save_path):
             os.makedirs(save_path)
 
+        from tqdm import tqdm
+
         for test_type in tqdm(TEST_TYPE_MAP.keys()):
             test_results = []
             print(f"Scoring {test_type}")
             if not os.path.exists(os.path.join(save_path, test_type)):
                 os.makedirs(os.path.join(save_path, test_type))
 
-            for year in range(2020, 2025):
-                if test_type == "薬剤":
-                    score_record, pass_or_not, failed_by_forbidden = self.score(test_type, year, answer_res_path, save_path, fix_format)
-                    test_result = {
-                        "test_type": test_type,
-                        "year": year,
-                        "total_score": score_record["total_score"],
-                        "must_score": score_record["must_score"],
-                    }
-                    area_keys = list(score_record["area_score"].keys())
-                    for area in area_keys:
-                        test_result[area] = score_record["area_score"][area]
-                        test_result[area + "_total"] = score_record["area_total_score"][area]
-                    test_result["pass_or_not"] = pass_or_not
-                    test_result["failed_by_forbidden"] = failed_by_forbidden
-                    test_results.append(deepcopy(test_result))
-                else:
-                    total_score, pass_or_not, failed_by_forbidden = self.score(test_type, year, answer_res_path, save_path, fix_format)
-                    must_score = 0 if isinstance(total_score, int) else total_score[0]
-                    total_score = total_score if isinstance(total_score, int) else sum(total_score)
-
-                    test_results.append({
-                        "test_type": test_type,
-                        "year": year,
-                        "total_score": total_score,
-                        "must_score": must_score,
-                        "pass_or_not": pass_or_not,
-                        "failed_by_forbidden": failed_by_forbidden
-                    })
-        
-            df = pd.DataFrame(test_results)
-            df.to_csv(os.path.join(save_path, test_type, "total_scores.csv"), index=False)
+            for year in YEARS:
+                test_results.append(self.score_year(test_type, year, answer_res_path, save_path, fix_format))
+
+            write_total_scores(test_results, os.path.join(save_path, test_type, "total_scores.csv"))
+            self.flush_history()
+        self.close_history()
+
+        totals = update_join_report(save_path, self.join_report, {(test_type, year) for test_type in TEST_TYPE_MAP for year in YEARS})
+        self.join_report = []
+        if any(totals.values()):
+            print(f"{company} {model} {input_type}: {totals['missing']} missing, {totals['extra']} extra, {totals['duplicate']} duplicate predictions, see {JOIN_REPORT}")
+        if fix_format:
+            print(f"{company} {model} {input_type}: fix_format repaired {self.n_repaired} predictions")
+        self.n_repaired = 0
+
+
+def build_test_result(test_type, year, total_score, pass_or_not, failed_by_forbidden):
+    """build the row of total_scores.csv from the return value of Scoring.score"""
+    if test_type == "薬剤":
+        score_record = total_score
+        test_result = {
+            "test_type": test_type,
+            "year": year,
+            "total_score": score_record["total_score"],
+            "must_score": score_record["must_score"],
+        }
+        area_keys = list(score_record["area_score"].keys())
+        for area in area_keys:
+            test_result[area] = score_record["area_score"][area]
+            test_result[area + "_total"] = score_record["area_total_score"][area]
+        test_result["pass_or_not"] = pass_or_not
+        test_result["failed_by_forbidden"] = failed_by_forbidden
+        return deepcopy(test_result)
+
+    must_score = 0 if isinstance(total_score, int) else total_score[0]
+    total_score = total_score if isinstance(total_score, int) else sum(total_score)
+
+    return {
+        "test_type": test_type,
+        "year": year,
+        "total_score": total_score,
+        "must_score": must_score,
+        "pass_or_not": pass_or_not,
+        "failed_by_forbidden": failed_by_forbidden
+    }
+
+
+def write_total_scores(test_results, csv_path):
+    """write the rows of one exam to total_scores.csv, ordered by year, as pandas.DataFrame.to_csv did without importing pandas"""
+    rows = sorted(test_results, key=lambda row: row["year"])
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    # the integer columns with empty cells (the pharmacy subjects missing in some years) were floats in pandas, written as 12.0
+    float_columns = {column for column in columns if any(column not in row for row in rows)
+                     and all(isinstance(row[column], numbers.Integral) and not isinstance(row[column], bool) for row in rows if column in row)}
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([("" if column not in row else repr(float(row[column])) if column in float_columns else str(row[column])) for column in columns])
+
+
+def select_combos(res_dir, models=None, input_types=None):
+    """the (company, model, input_type) combinations under res_dir matching the filters
+    Args:
+        res_dir (str): the path to the result of the LLMs
+        models (str[]): glob patterns of company/model, e.g. openai/gpt-4o* or */llama*, None for all
+        input_types (str[]): e.g. text or multimodal, None for all
+    """
+    return [(company, model, input_type) for company, model, input_type in list_model_dirs(res_dir)
+            if (models is None or any(fnmatch.fnmatchcase(f"{company}/{model}", pattern) for pattern in models))
+            and (input_types is None or input_type in input_types)]
+
+
+def parse_years(text):
+    """the years of 2023, 2021-2023 or 2020,2022"""
+    years = []
+    for part in text.split(","):
+        start, _, end = part.partition("-")
+        years.extend(range(int(start), int(end or start) + 1))
+    return sorted(set(years))
+
+
+def list_model_dirs(res_dir):
+    """list the (company, model, input_type) combinations under res_dir in a stable order"""
+    combos = []
+    for company in sorted(os.listdir(res_dir)):
+        if not os.path.isdir(os.path.join(res_dir, company)):
+            continue
+        for model in sorted(os.listdir(os.path.join(res_dir, company))):
+            if not os.path.isdir(os.path.join(res_dir, company, model)):
+                continue
+            for input_type in sorted(os.listdir(os.path.join(res_dir, company, model))): # text or multimodal
+                if os.path.isdir(os.path.join(res_dir, company, model, input_type)):
+                    combos.append((company, model, input_type))
+    return combos
+
+
+def output_version(history_format="json", export_json=False, sample=0):
+    """the version the manifest records for each unit, the outputs are part of it so that switching the history format scores everything again"""
+    return f"{SCORING_VERSION}|{history_format}|{export_json}|{sample}"
+
+
+# the Scoring instance of a worker process, created once by _init_worker
+_worker_scoring = None
+
+
+def _init_worker(res_dir, score_dir, data_dir, cache_dir=None, history_format="json", export_json=False, sample=0, exam_store=None, collect_outcomes=False,
+                 metrics=False):
+    global _worker_scoring
+    _worker_scoring = Scoring(res_dir, score_dir, data_dir, cache_dir, history_format, export_json, sample, exam_store, collect_outcomes, metrics)
+
+
+def _score_unit(unit, fix_format=False, profile_path=None):
+    """score one (company, model, input_type, test_type, year) unit in a worker process
+    Args:
+        unit (tuple): (company, model, input_type, test_type, year)
+        fix_format (bool): see Scoring.score
+        profile_path (str): if given, the unit is scored under cProfile and the stats are saved to this path
+    Returns:
+        result (dict): the unit, its row of total_scores.csv, the traceback if it failed, the sections whose predictions did not match the questions,
+            the history for the parent to append to the history table if the history format is parquet or arrow, the number of predictions repaired by fix_format,
+            the outcome of each question if the results database is written, and the stage metrics if they are recorded
+    """
+    company, model, input_type, test_type, year = unit
+    answer_res_path = os.path.join(_worker_scoring.res_dir, company, model, input_type)
+    save_path = os.path.join(_worker_scoring.score_dir, company, model, input_type)
+    try:
+        if profile_path is not None:
+            with profiled(profile_path):
+                row = _worker_scoring.score_year(test_type, year, answer_res_path, save_path, fix_format)
+        else:
+            row = _worker_scoring.score_year(test_type, year, answer_res_path, save_path, fix_format)
+        result = {"unit": unit, "row": row, "error": None, "history": _worker_scoring.pending_history, "join_report": _worker_scoring.join_report,
+                  "n_repaired": _worker_scoring.n_repaired, "outcomes": _worker_scoring.outcomes}
+    except Exception:
+        result = {"unit": unit, "row": None, "error": traceback.format_exc(), "history": [], "join_report": [], "n_repaired": 0, "outcomes": None}
+    result["normalize_stats"] = (os.getpid(), normalization_stats())
+    result["metrics"] = _worker_scoring.metrics.pop()
+    _worker_scoring.pending_history = []
+    _worker_scoring.join_report = []
+    _worker_scoring.n_repaired = 0
+    if _worker_scoring.outcomes is not None:
+        _worker_scoring.outcomes = []
+    return result
+
+
+def score_all(res_dir, score_dir, data_dir, num_workers=None, fix_format=False, combos=None, cache_dir=None, incremental=False,
+              history_format="json", export_json=False, sample=0, exam_store=None, results_db=None, metrics_dir=None, profile_unit=None, exams=None, years=None):
+    """score every (company, model, input_type, test_type, year) unit over a process pool
+    Args:
+        res_dir (str): the path to the result of the LLMs
+        score_dir (str): the path to save the scoring result
+        data_dir (str): the path to the ground truth data
+        num_workers (int): the number of worker processes, defaults to the number of cores. 1 scores in this process
+        fix_format (bool): if True, extract the answer from verbose outputs before scoring, see answer_extraction.py
+        combos (list): the (company, model, input_type) combinations to score, defaults to all in res_dir
+        cache_dir (str): the path to cache the parsed ground truth across runs and worker processes
+        incremental (bool): if True, only score the units whose predictions, ground truth or scoring version changed since the last run, see manifest.py
+        history_format (str): json, parquet or arrow, see Scoring. the rows of the history table are appended in the order the units finish
+        export_json (bool): if True, also write the *_history.json files when history_format is parquet or arrow
+        sample (int): the sample to score when the JSONL predictions have several samples per question
+        exam_store (str): the path to the exam store to read the ground truth from instead of the json files, see exam_store.py
+        results_db (str): the path to the SQLite database to write the totals and the outcome of each question to, see results_db.py
+        metrics_dir (str): if given, the time, items and bytes of each stage of each unit are written to metrics.json and metrics.prom in it, see metrics.py
+        profile_unit (str): company/model/input_type/exam/year of a unit to score under cProfile, the stats are saved to score_dir/profile.prof
+        exams (str[]): the exams to score, defaults to all
+        years (int[]): the years to score, defaults to YEARS. the rows of the other years in total_scores.csv are kept
+    Returns:
+        failures (list): (unit, traceback) of the units that failed, the other units are saved anyway and the failed ones keep their row of the previous run
+    """
+    from tqdm import tqdm
+
+    if combos is None:
+        combos = list_model_dirs(res_dir)
+    exams = list(TEST_TYPE_MAP) if exams is None else exams
+    years = list(YEARS) if years is None else years
+    # only some of the units of a model, the rest of its outputs is kept
+    partial = set(exams) != set(TEST_TYPE_MAP) or set(years) != set(YEARS)
+
+    version = output_version(history_format, export_json, sample)
+    store = open_store(exam_store, data_dir) if incremental else None
+    db = ResultsDatabase(results_db) if results_db is not None else None
+    metrics = StageMetrics(enabled=metrics_dir is not None)
+    units = []
+    results = []
+    manifests = {}
+    digests = {}
+    kept_rows = {} # (company, model, input_type, test_type) -> the rows of the years not selected
+    previous_rows = {} # (company, model, input_type, test_type) -> the rows on disk by year, kept for the units that fail
+    for company, model, input_type in combos:
+        save_path = os.path.join(score_dir, company, model, input_type)
+        if incremental:
+            manifests[(company, model, input_type)] = load_manifest(save_path) if os.path.exists(save_path) else {"units": {}}
+        for test_type in exams:
+            os.makedirs(os.path.join(save_path, test_type), exist_ok=True)
+            exam_rows = previous_rows[(company, model, input_type, test_type)] = read_total_scores(os.path.join(save_path, test_type, "total_scores.csv"))
+            kept_rows[(company, model, input_type, test_type)] = [row for year, row in exam_rows.items() if year not in years] if incremental or partial else []
+            for year in years:
+                unit = (company, model, input_type, test_type, year)
+                if incremental:
+                    digests[unit] = unit_digest(data_dir, os.path.join(res_dir, company, model, input_type), test_type, year, version, fix_format, store)
+                    manifest_units = manifests[(company, model, input_type)]["units"]
+                    if manifest_units.get(f"{test_type}/{year}") == digests[unit] and year in exam_rows and (db is None or db.has_unit(*unit)):
+                        # unchanged since the last run, the rows and the *_history.json files on disk are still valid
+                        results.append({"unit": unit, "row": exam_rows[year], "error": None})
+                        continue
+                units.append(unit)
+
+    n_reused = len(results)
+    normalize_stats = {} # pid -> the latest cache statistics of normalize_answer in that process
+
+    # the history tables are written by this process as the units finish, the workers only send their rows
+    history_writers = {}
+    replaced_units = {}
+    for company, model, input_type, test_type, year in units:
+        replaced_units.setdefault(os.path.join(score_dir, company, model, input_type), set()).add((test_type, year))
+
+    def collect(result):
+        pid, stats = result.pop("normalize_stats")
+        normalize_stats[pid] = stats
+        metrics.merge(result.pop("metrics"))
+        for save_path, test_type, history_data in result.pop("history"):
+            with metrics.stage("write_history_table", result["unit"]) as timing:
+                if save_path not in history_writers:
+                    history_writers[save_path] = HistoryTableWriter(save_path, history_format, replaced_units=replaced_units[save_path])
+                history_writers[save_path].append(test_type, history_data)
+                timing.add(len(history_data))
+        if result["error"] is not None:
+            # the old history rows of the unit stay, as its row of total_scores.csv does
+            replaced_units[os.path.join(score_dir, *result["unit"][:3])].discard(result["unit"][3:])
+        outcomes = result.pop("outcomes")
+        if db is not None and result["error"] is None:
+            db.replace_unit(*result["unit"], result["row"], outcomes)
+        results.append(result)
+
+    def profile_path(unit):
+        return os.path.join(score_dir, "profile.prof") if "/".join(str(part) for part in unit) == profile_unit else None
+
+    worker_args = (res_dir, score_dir, data_dir, cache_dir, history_format, export_json, sample, exam_store, db is not None, metrics.enabled)
+    if num_workers == 1 or len(units) <= 1:
+        _init_worker(*worker_args)
+        for unit in tqdm(units):
+            collect(_score_unit(unit, fix_format, profile_path(unit)))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=worker_args) as executor:
+            futures = [executor.submit(_score_unit, unit, fix_format, profile_path(unit)) for unit in units]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                collect(future.result())
+    if profile_unit is not None and not any(profile_path(unit) for unit in units):
+        print(f"{profile_unit} was not scored, nothing profiled")
+    for save_path, writer in history_writers.items():
+        with metrics.stage("write_history_table", tuple(os.path.relpath(save_path, score_dir).split(os.sep))) as timing:
+            writer.close()
+            timing.add(0, os.path.getsize(writer.path))
+    if db is not None:
+        db.close()
+
+    # merge the rows of each exam in a fixed order, independent of the completion order
+    rows = {}
+    failures = []
+    carried = set() # the failed units whose row of the previous run is written again
+    for result in results:
+        company, model, input_type, test_type, year = result["unit"]
+        row = result["row"]
+        if result["error"] is not None:
+            failures.append((result["unit"], result["error"]))
+            row = previous_rows[(company, model, input_type, test_type)].get(year)
+            if row is None:
+                continue
+            carried.add(result["unit"])
+        rows.setdefault((company, model, input_type, test_type), []).append(row)
+
+    for combo_exam, test_results in kept_rows.items():
+        if combo_exam in rows:
+            test_results.extend(rows[combo_exam])
+            rows[combo_exam] = test_results
+    for (company, model, input_type, test_type), test_results in sorted(rows.items()):
+        csv_path = os.path.join(score_dir, company, model, input_type, test_type, "total_scores.csv")
+        with metrics.stage("write_total_scores", (company, model, input_type, test_type)) as timing:
+            write_total_scores(test_results, csv_path)
+            timing.add(len(test_results), os.path.getsize(csv_path))
+
+    # the sections whose predictions did not match the questions, the entries of the reused units are kept
+    scored_units = {}
+    for unit in units:
+        scored_units.setdefault(unit[:3], set()).add(unit[3:])
+    join_reports = {}
+    for result in results:
+        join_reports.setdefault(result["unit"][:3], []).extend(result.get("join_report", []))
+    for combo in sorted(scored_units):
+        totals = update_join_report(os.path.join(score_dir, *combo), join_reports.get(combo, []), scored_units[combo])
+        if any(totals.values()):
+            print(f"{' '.join(combo)}: {totals['missing']} missing, {totals['extra']} extra, {totals['duplicate']} duplicate predictions, see {JOIN_REPORT}")
+    if fix_format:
+        # the units reused by the incremental mode were not extracted again and are not counted
+        n_repaired = {}
+        for result in results:
+            n_repaired[result["unit"][:3]] = n_repaired.get(result["unit"][:3], 0) + result.get("n_repaired", 0)
+        for combo in sorted(scored_units):
+            print(f"{' '.join(combo)}: fix_format repaired {n_repaired.get(combo, 0)} predictions")
+
+    failures.sort(key=lambda failure: failure[0])
+    if incremental:
+        failed_units = {unit for unit, _ in failures}
+        for unit in units:
+            company, model, input_type, test_type, year = unit
+            manifest_units = manifests[(company, model, input_type)]["units"]
+            if unit in failed_units:
+                manifest_units.pop(f"{test_type}/{year}", None) # scored again on the next run
+            else:
+                manifest_units[f"{test_type}/{year}"] = digests[unit]
+        for (company, model, input_type), manifest in manifests.items():
+            manifest["scoring_version"] = SCORING_VERSION
+            save_manifest(os.path.join(score_dir, company, model, input_type), manifest)
+
+    for unit, error in failures:
+        kept = "kept the row of the previous run" if unit in carried else "no previous row"
+        print(f"Failed to score {' '.join(str(part) for part in unit)} ({kept} in total_scores.csv):\n{error}")
+    if normalize_stats:
+        hits = sum(stats["hits"] for stats in normalize_stats.values())
+        misses = sum(stats["misses"] for stats in normalize_stats.values())
+        print(f"normalize_answer cache: {hits} hits, {misses} misses ({hits / max(hits + misses, 1):.1%} hit rate) over {len(normalize_stats)} processes")
+    if metrics.enabled:
+        metrics.write(metrics_dir)
+        slowest = sorted(metrics.summary()["stages"].items(), key=lambda item: -item[1]["seconds"])
+        print("Stages: " + ", ".join(f"{name} {totals['seconds']:.2f}s" for name, totals in slowest) + f", see {metrics_dir}")
+    if incremental:
+        print(f"Reused {n_reused} unchanged units")
+    print(f"Scored {len(units) - len(failures)}/{len(units)} units")
+    return failures
+
+
+def score_all_vectorized(res_dir, score_dir, data_dir, combos=None, cache_dir=None, fix_format=False, exam_store=None, exams=None, years=None, sample=0):
+    """score every (company, model, input_type) at once per exam and year with the NumPy engine.
+    only total_scores.csv is written, use score_all for the *_history.json files
+    Args:
+        res_dir (str): the path to the result of the LLMs
+        score_dir (str): the path to save the scoring result
+        data_dir (str): the path to the ground truth data
+        combos (list): the (company, model, input_type) combinations to score, defaults to all in res_dir
+        cache_dir (str): the path to cache the parsed ground truth across runs
+        fix_format (bool): if True, extract the answer from verbose outputs before scoring, see answer_extraction.py
+        exam_store (str): the path to the exam store to read the ground truth from instead of the json files, see exam_store.py
+        exams (str[]): the exams to score, defaults to all
+        years (int[]): the years to score, defaults to YEARS. the rows of the other years in total_scores.csv are kept
+        sample (int): the sample to score when the JSONL predictions have several samples per question
+    """
+    from tqdm import tqdm
+    from vectorized_scoring import VectorizedScoring
+
+    if combos is None:
+        combos = list_model_dirs(res_dir)
+    years = list(YEARS) if years is None else years
+    answer_res_paths = [os.path.join(res_dir, *combo) for combo in combos]
+    engine = VectorizedScoring(data_dir, cache_dir, exam_store, sample)
+
+    for test_type in tqdm(list(TEST_TYPE_MAP) if exams is None else exams):
+        rows = {}
+        for combo in combos:
+            previous_rows = read_total_scores(os.path.join(score_dir, *combo, test_type, "total_scores.csv")) if set(years) != set(YEARS) else {}
+            rows[combo] = [row for year, row in previous_rows.items() if year not in years]
+        for year in years:
+            for combo, result in zip(combos, engine.score(test_type, year, answer_res_paths, fix_format)):
+                rows[combo].append(build_test_result(test_type, year, *result))
+
+        for combo, test_results in rows.items():
+            os.makedirs(os.path.join(score_dir, *combo, test_type), exist_ok=True)
+            write_total_scores(test_results, os.path.join(score_dir, *combo, test_type, "total_scores.csv"))
 
 
 if __name__ == "__main__":
-    if not os.path.exists("./scoring"):
-        os.makedirs("./scoring")
-
-    scoring = Scoring("./results", "./scoring", "./exams/JA") # TODO: add the passing scores for each test
-    for company in os.listdir("./results"):
-        for model in os.listdir(os.path.join("./results", company)):
-            for input_type in os.listdir(os.path.join("./results", company, model)): # text or multimodal
-                print(f"Scoring {company} {model} {input_type}")
-                scoring.total_scores(company, model, input_type)
-    
-
-    
-
-
+    parser = argparse.ArgumentParser(description="score the result of the LLMs")
+    parser.add_argument("--engine", type=str, default="loop", choices=["loop", "vectorized"], help="vectorized scores all the models at once with NumPy but writes no history")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="the number of worker processes, 1 to score serially")
+    parser.add_argument("--incremental", action="store_true", help="only score the units whose inputs changed since the last run")
+    parser.add_argument("--history_format", type=str, default="json", choices=HISTORY_FORMATS, help="parquet or arrow writes one history table per model and input type instead of the *_history.json files")
+    parser.add_argument("--export_json", action="store_true", help="also write the *_history.json files with --history_format parquet or arrow")
+    parser.add_argument("--sample", type=int, default=0, help="the sample to score when the JSONL predictions have several samples per question")
+    parser.add_argument("--fix_format", action="store_true", help="extract the answer from verbose outputs such as 正解は3と5です before scoring")
+    parser.add_argument("--exam_store", type=str, default=None, help="read the ground truth from the SQLite file built by exam_store.py, e.g. ./exams/exams.sqlite")
+    parser.add_argument("--cache_dir", type=str, default=None, help="the path to cache the parsed ground truth across runs, e.g. ./scoring/.ground_truth_cache")
+    parser.add_argument("--metrics_dir", type=str, default=None, help="write the time, items and bytes of each stage to metrics.json and metrics.prom in this directory")
+    parser.add_argument("--profile_unit", type=str, default=None, help="company/model/input_type/exam/year of a unit to score under cProfile, saved to ./scoring/profile.prof")
+    parser.add_argument("--results_db", type=str, default=None, help="also write the totals and the outcome of each question to this SQLite file, e.g. ./scoring/results.sqlite")
+    parser.add_argument("--models", type=str, nargs="+", default=None, help="glob patterns of company/model to score, e.g. openai/gpt-4o* '*/llama*'")
+    parser.add_argument("--input_type", type=str, nargs="+", default=None, help="text and/or multimodal")
+    parser.add_argument("--exams", type=str, nargs="+", default=None, choices=list(TEST_TYPE_MAP), help="the exams to score, e.g. 医師 薬剤")
+    parser.add_argument("--years", type=parse_years, default=None, help="the years to score, e.g. 2024, 2022-2024 or 2020,2023")
+    parser.add_argument("--output_format", type=str, default=None, choices=["table", "json", "csv"], help="print the rows of the scored units")
+    parser.add_argument("--res_dir", type=str, default="./results")
+    parser.add_argument("--score_dir", type=str, default="./scoring")
+    parser.add_argument("--data_dir", type=str, default="./exams/JA")
+    args = parser.parse_args()
+
+    combos = select_combos(args.res_dir, args.models, args.input_type)
+    if not combos:
+        parser.error(f"No model in {args.res_dir} matches --models {args.models} --input_type {args.input_type}")
+    if args.years is not None and not set(args.years) <= set(YEARS):
+        parser.error(f"--years must be within {YEARS.start}-{YEARS.stop - 1}")
+    os.makedirs(args.score_dir, exist_ok=True)
+
+    # TODO: add the passing scores for each test
+    if args.engine == "vectorized":
+        if args.results_db is not None:
+            parser.error("--results_db needs the per-question outcomes of --engine loop")
+        score_all_vectorized(args.res_dir, args.score_dir, args.data_dir, combos=combos, cache_dir=args.cache_dir, fix_format=args.fix_format,
+                             exam_store=args.exam_store, exams=args.exams, years=args.years, sample=args.sample)
+    else:
+        score_all(args.res_dir, args.score_dir, args.data_dir, num_workers=args.num_workers, fix_format=args.fix_format, combos=combos, cache_dir=args.cache_dir,
+                  incremental=args.incremental, history_format=args.history_format, export_json=args.export_json, sample=args.sample, exam_store=args.exam_store,
+                  results_db=args.results_db, metrics_dir=args.metrics_dir, profile_unit=args.profile_unit, exams=args.exams, years=args.years)
+
+    if args.output_format is not None:
+        printed = []
+        for combo in combos:
+            for test_type in args.exams or TEST_TYPE_MAP:
+                rows = read_total_scores(os.path.join(args.score_dir, *combo, test_type, "total_scores.csv"))
+                printed.extend({"company": combo[0], "model": combo[1], "input_type": combo[2], **row} for year, row in sorted(rows.items())
+                               if args.years is None or year in args.years)
+        if args.output_format == "json":
+            print(json.dumps(printed, indent=4, ensure_ascii=False))
+        else:
+            columns = ["company", "model", "input_type", "test_type", "year", "total_score", "must_score", "pass_or_not", "failed_by_forbidden"]
+            if args.output_format == "csv":
+                columns = list(dict.fromkeys(columns + [column for row in printed for column in row]))
+            writer = csv.writer(sys.stdout, delimiter="\t" if args.output_format == "table" else ",", lineterminator="\n")
+            writer.writerow(columns)
+            writer.writerows([row.get(column, "") for column in columns] for row in printed)
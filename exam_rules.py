@@ -0,0 +1,190 @@
+"""
+the scoring rules of each exam, compiled once per (exam, year) into a plan that Scoring and VectorizedScoring execute
+"""
+
+# sections: the sections of the exam in the order they are scored
+# section_groups / index_bounds: how the questions are split into sub scores, by section or by the upper bound of the question number of each sub score
+# pass_lines: the passing score of each sub score by year, a single number for the exams scored by the total only. the years listed here are the years
+#   scored (see YEARS), so a new year needs the pass lines of every exam
+# forbidden_limit: the exam is failed if more than this many forbidden choices (kinki) are selected
+# skip_corrected: if False, the questions with corrected_question_index are still scored
+# must_section, must_line, area_ratio: the pharmacy rule, the must section has its own passing score and the correct points of each subject
+#   outside the must section should be at least area_ratio of the correct points of that subject in the whole exam
+EXAM_RULES = {
+    "医師": {
+        "sections": ["B", "E", "A", "C", "D", "F"],
+        "section_groups": {"B": 0, "E": 0, "A": 1, "C": 1, "D": 1, "F": 1}, # 必修: B、E；一般: A、C、D、F
+        "pass_lines": {
+            "2020": [158, 217], # 必修158, 一般217
+            "2021": [160, 209], # 必修160, 一般209
+            "2022": [158, 214], # 必修158, 一般214
+            "2023": [160, 220], # 必修160, 一般220
+            "2024": [160, 230]  # 必修160, 一般230
+        },
+        "forbidden_limit": 3,
+        "skip_corrected": False,
+    },
+    "歯科": {
+        "sections": ["A", "B", "C", "D"],
+        "index_bounds": [20, 45], # 必修: ~20, 領域A: ~45, 領域B: the rest
+        "pass_lines": {
+            "2020": [64, 65, 260], # 必修64, 領域A65, 領域B260
+            "2021": [63, 53, 236], # 必修63, 領域A53, 領域B236
+            "2022": [64, 59, 237], # 必修64, 領域A59, 領域B237
+            "2023": [64, 63, 257], # 必修64, 領域A63, 領域B257
+            "2024": [64, 60, 254]  # 必修64, 領域A60, 領域B254
+        },
+        "forbidden_limit": 3,
+    },
+    "看護": {
+        "sections": ["A", "B"],
+        "index_bounds": [25], # 必修: ~25, 一般: the rest
+        "pass_lines": {
+            "2020": [40, 155], # 必修40,一般155
+            "2021": [40, 159], # 必修40,一般159
+            "2022": [40, 167], # 必修40,一般167
+            "2023": [40, 152], # 必修40,一般152
+            "2024": [40, 158]  # 必修40,一般158
+        },
+    },
+    "保健": {"sections": ["A", "B"], "pass_lines": {year: 87 for year in ["2020", "2021", "2022", "2023", "2024"]}},
+    "理学": {"sections": ["A", "B"], "index_bounds": [80], "pass_lines": {year: [168, 43] for year in ["2020", "2021", "2022", "2023", "2024"]}}, # 必修: ~80, 実地: the rest
+    "作業": {"sections": ["A", "B"], "index_bounds": [80], "pass_lines": {year: [168, 43] for year in ["2020", "2021", "2022", "2023", "2024"]}}, # 必修: ~80, 実地: the rest
+    "助産": {"sections": ["A", "B"], "pass_lines": {year: 87 for year in ["2020", "2021", "2022", "2023", "2024"]}},
+    "診療": {"sections": ["A", "B"], "pass_lines": {year: 120 for year in ["2020", "2021", "2022", "2023", "2024"]}},
+    "視能": {"sections": ["A", "B"], "pass_lines": {year: 102 for year in ["2020", "2021", "2022", "2023", "2024"]}},
+    "薬剤": {
+        "sections": ["a1", "a2", "a3", "b1", "b2", "b3"],
+        "pass_lines": {
+            "2020": 426, # total score
+            "2021": 430,
+            "2022": 434,
+            "2023": 470,
+            "2024": 420,
+        },
+        "must_section": "a1",
+        "must_line": 126, # 必修 >70% correct
+        "area_ratio": 0.3, # each subject >30% correct in must
+    },
+}
+
+
+def _rule_years(exam):
+    return sorted(int(year) for year in EXAM_RULES[exam]["pass_lines"])
+
+
+# the years scored by default. every exam lists the pass lines of the same consecutive years, so that no (exam, year) is left without them
+YEARS = range(_rule_years("医師")[0], _rule_years("医師")[-1] + 1)
+_MISMATCHED = [exam for exam in EXAM_RULES if _rule_years(exam) != list(YEARS)]
+if _MISMATCHED:
+    raise ValueError(f"The pass lines of {_MISMATCHED} are not for the years {YEARS.start}-{YEARS.stop - 1} of 医師, every exam should list the same years")
+
+
+def get_pass_lines(exam, year):
+    pass_lines = EXAM_RULES[exam]["pass_lines"]
+    if str(year) not in pass_lines:
+        raise ValueError(f"No pass lines of {exam} {year} in EXAM_RULES")
+    return pass_lines[str(year)]
+
+
+class ScoringPlan:
+    def __init__(self, exam, year, ground_truth):
+        """the rules of one exam and year resolved against its questions, so that scoring is a single loop without per-exam branches
+        Args:
+            exam (str): the type of the exam, e.g. 医師
+            year (int): the year of the exam
+            ground_truth (GroundTruthIndex): the ground truth of the exams
+        """
+        rule = EXAM_RULES[exam]
+        self.exam = exam
+        self.year = year
+        self.rule = rule
+        self.pass_lines = get_pass_lines(exam, year)
+        self.forbidden_limit = rule.get("forbidden_limit")
+        self.has_areas = "must_section" in rule
+
+        # the questions of every section, with the sub score, whether it is scored and the subject of each question
+        self.sections = [] # (section, questions)
+        self.groups = []
+        self.valid = []
+        self.area_ids = []
+        self.areas = [] # the subjects in the order they first appear among the scored questions, which is the column order of total_scores.csv
+        for section in rule["sections"]:
+            questions = ground_truth.get(exam, year, section)
+            self.sections.append((section, questions))
+            for problem in questions:
+                self.groups.append(self._group(section, problem))
+                valid = problem["answer"] != "" and not (rule.get("skip_corrected", True) and problem["corrected"])
+                self.valid.append(valid)
+                if self.has_areas and valid and problem["subject"] not in self.areas:
+                    self.areas.append(problem["subject"])
+                self.area_ids.append(self.areas.index(problem["subject"]) if self.has_areas and valid else -1)
+
+        if isinstance(self.pass_lines, list):
+            self.n_groups = len(self.pass_lines)
+        else:
+            self.n_groups = 2 if self.has_areas else 1
+
+    def _group(self, section, problem):
+        if "section_groups" in self.rule:
+            return self.rule["section_groups"][section]
+        if "index_bounds" in self.rule:
+            index = int(problem["index"].split("-")[0])
+            for group, bound in enumerate(self.rule["index_bounds"]):
+                if index <= bound:
+                    return group
+            return len(self.rule["index_bounds"])
+        if self.has_areas:
+            return 0 if section == self.rule["must_section"] else 1
+        return 0
+
+    def judge(self, sub_scores, count_forbidden, area_score=None, area_total_score=None):
+        """decide the result of the exam from the sums of the scoring loop
+        Args:
+            sub_scores (int[]): the points earned in each sub score
+            count_forbidden (int): the number of questions where a forbidden choice was selected
+            area_score (int[]): the points earned in each subject outside the must section
+            area_total_score (int[]): the points earned in each subject
+        Returns:
+            total_score (int[], int or dict): the sub scores, the total score if the exam has a single passing score, or the score record of 薬剤
+            pass_or_not (bool): whether the LLM passed the exam
+            failed_by_forbidden (bool): if more than forbidden_limit forbidden choices were selected, return True
+        """
+        failed_by_forbidden = self.forbidden_limit is not None and count_forbidden > self.forbidden_limit
+
+        if self.has_areas:
+            total_score = sum(sub_scores)
+            score_record = {
+                "total_score": total_score,
+                "must_score": sub_scores[0],
+                "area_score": dict(zip(self.areas, area_score)),
+                "area_total_score": dict(zip(self.areas, area_total_score)),
+            }
+            pass_or_not = total_score >= self.pass_lines and sub_scores[0] >= self.rule["must_line"] and \
+                all(score >= self.rule["area_ratio"] * total for score, total in zip(area_score, area_total_score))
+            return score_record, pass_or_not, failed_by_forbidden
+
+        if isinstance(self.pass_lines, list):
+            pass_or_not = all(score >= line for score, line in zip(sub_scores, self.pass_lines)) and not failed_by_forbidden
+            return list(sub_scores), pass_or_not, failed_by_forbidden
+
+        total_score = sum(sub_scores)
+        return total_score, total_score >= self.pass_lines and not failed_by_forbidden, failed_by_forbidden
+
+
+# one plan per (exam, year) and ground truth index in each process
+_plans = {}
+
+
+def get_plan(exam, year, ground_truth):
+    key = (exam, str(year), id(ground_truth))
+    if key not in _plans:
+        _plans[key] = ScoringPlan(exam, year, ground_truth)
+    return _plans[key]
+
+
+def invalidate_plans(ground_truth, exam=None, year=None):
+    """drop the plans of an exam and year (every exam and year if None) built on ground_truth, after its questions changed"""
+    for key in list(_plans):
+        if key[2] == id(ground_truth) and (exam is None or key[0] == exam) and (year is None or key[1] == str(year)):
+            del _plans[key]
@@ -0,0 +1,152 @@
+"""
+pack the exam json files of every language into a single SQLite file with random access by (exam, year, section, index)
+
+    python exam_store.py --exams_dir ./exams --out ./exams/exams.sqlite
+
+then pass --exam_store ./exams/exams.sqlite to calculate_scores.py and inference.py to read the questions from it instead of the json files
+"""
+
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import argparse
+from utils import atomic_write, to_float
+
+STORE_NAME = "exams.sqlite"
+SECTION_FILE_PATTERN = re.compile(r'^(?P<exam>.+)_(?P<year>\d{4})_(?P<section>[^_]+)\.json$')
+
+SCHEMA = """
+CREATE TABLE sections (
+    language TEXT NOT NULL,
+    exam TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (language, exam, year, section)
+);
+CREATE TABLE questions (
+    language TEXT NOT NULL,
+    exam TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    question_index TEXT NOT NULL,
+    answer TEXT,
+    points INTEGER,
+    kinki TEXT,
+    subject TEXT,
+    text_only INTEGER,
+    human_accuracy REAL,
+    payload TEXT NOT NULL, -- the question as it is in the json, with the question text, the choices and the image references
+    PRIMARY KEY (language, exam, year, section, position)
+);
+CREATE INDEX questions_by_index ON questions (language, exam, year, section, question_index);
+"""
+
+
+def build_store(exams_dir, path):
+    """pack exams_dir/<language>/<exam>/<exam>_<year>_<section>.json into one SQLite file, replaced atomically
+    Returns:
+        n_questions (int): the number of questions packed
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with atomic_write(path, "wb") as tmp_file:
+        # sqlite writes the temporary file itself, tmp_file is left empty
+        connection = sqlite3.connect(tmp_file.name)
+        try:
+            connection.executescript(SCHEMA)
+
+            n_questions = 0
+            for language in sorted(os.listdir(exams_dir)):
+                language_dir = os.path.join(exams_dir, language)
+                if not os.path.isdir(language_dir):
+                    continue
+                for exam in sorted(os.listdir(language_dir)):
+                    if not os.path.isdir(os.path.join(language_dir, exam)):
+                        continue
+                    for file_name in sorted(os.listdir(os.path.join(language_dir, exam))):
+                        match = SECTION_FILE_PATTERN.match(file_name)
+                        if match is None or match.group("exam") != exam:
+                            continue
+                        with open(os.path.join(language_dir, exam, file_name), "rb") as f:
+                            data = f.read()
+                        year, section = int(match.group("year")), match.group("section").lower()
+                        connection.execute("INSERT INTO sections VALUES (?, ?, ?, ?, ?, ?)", (language, exam, year, section, file_name, hashlib.sha256(data).hexdigest()))
+                        rows = []
+                        for position, problem in enumerate(json.loads(data)):
+                            rows.append((
+                                language, exam, year, section, position, str(problem["index"]), problem.get("answer"), problem.get("points"), problem.get("kinki"),
+                                problem.get("answer_sub2"), problem.get("text_only"), to_float(problem.get("human_accuracy")), json.dumps(problem, ensure_ascii=False),
+                            ))
+                        connection.executemany("INSERT INTO questions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                        n_questions += len(rows)
+
+            connection.commit()
+        finally:
+            connection.close()
+    return n_questions
+
+
+class ExamStore:
+    def __init__(self, path, language="JA"):
+        """read the questions of one language from a store built by build_store
+        Args:
+            path (str): the path to the SQLite file
+            language (str): the language directory the questions were packed from, e.g. JA or EN
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No exam store at {path}, build it with exam_store.py")
+        self.path = path
+        self.language = language
+        # read only, so that the connection can be used from the threads of the inference run
+        self.connection = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, check_same_thread=False)
+
+    def has_section(self, exam, year, section):
+        row = self.connection.execute("SELECT 1 FROM sections WHERE language = ? AND exam = ? AND year = ? AND section = ?",
+                                      (self.language, exam, int(year), section.lower())).fetchone()
+        return row is not None
+
+    def section(self, exam, year, section):
+        """the questions of one section in their order, as they are in the json file
+        Raises:
+            FileNotFoundError: if the section was not packed
+        """
+        rows = self.connection.execute("SELECT payload FROM questions WHERE language = ? AND exam = ? AND year = ? AND section = ? ORDER BY position",
+                                       (self.language, exam, int(year), section.lower())).fetchall()
+        if not rows and not self.has_section(exam, year, section):
+            raise FileNotFoundError(f"No {exam} {year} {section} in {self.path}")
+        return [json.loads(payload) for payload, in rows]
+
+    def question(self, exam, year, section, index):
+        """one question by its index, None if there is no such question"""
+        row = self.connection.execute("SELECT payload FROM questions WHERE language = ? AND exam = ? AND year = ? AND section = ? AND question_index = ? ORDER BY position",
+                                      (self.language, exam, int(year), section.lower(), str(index))).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def file_digests(self, exam, year):
+        """(file name, sha256) of the json files an exam and year was packed from, the same as hashing the files themselves"""
+        return self.connection.execute("SELECT file_name, sha256 FROM sections WHERE language = ? AND exam = ? AND year = ? ORDER BY file_name",
+                                       (self.language, exam, int(year))).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def open_store(path, data_dir):
+    """the store of the language of data_dir (e.g. ./exams/JA), None if path is None"""
+    if path is None:
+        return None
+    return ExamStore(path, os.path.basename(os.path.normpath(data_dir)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pack the exam json files into a single SQLite file")
+    parser.add_argument("--exams_dir", type=str, default="./exams", help="the directory of the language directories, e.g. JA and EN")
+    parser.add_argument("--out", type=str, default=os.path.join("./exams", STORE_NAME))
+    args = parser.parse_args()
+
+    n_questions = build_store(args.exams_dir, args.out)
+    print(f"Packed {n_questions} questions into {args.out}")
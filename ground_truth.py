@@ -0,0 +1,111 @@
+"""
+load the ground truth of the exams once and share it between all the scoring runs
+"""
+
+import os
+import json
+import pickle
+from utils import normalize_answer, encode_answer, choice_mask, atomic_write
+from exam_store import open_store
+
+# bump when the fields of the questions change, so that old caches are rebuilt
+CACHE_VERSION = 3
+
+
+class GroundTruthIndex:
+    def __init__(self, data_dir, cache_dir=None, store=None):
+        """index of the ground truth data, each (exam, year, section) file is parsed at most once per process
+        Args:
+            data_dir (str): the path to the ground truth data
+            cache_dir (str): the path to keep a pickled copy of the parsed files, keyed by the mtime and size of the json. None to disable
+            store (ExamStore): if given, the questions are read from it instead of the json files in data_dir, see exam_store.py
+        """
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.store = store
+        self.questions = {} # (exam, year, section) -> list of questions
+        self.bytes_read = 0 # of the json and cache files parsed, for metrics.py
+
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, exam, year, section):
+        return os.path.join(self.data_dir, exam, f"{exam}_{year}_{section.lower()}.json")
+
+    def get(self, exam, year, section):
+        """the questions of one section of an exam
+        Args:
+            exam (str): the type of the exam, e.g. 医師
+            year (int or str): the year of the exam
+            section (str): the section of the exam, e.g. A or a1
+        Returns:
+            questions (dict[]): index, text_only, kinki, subject, answer (normalized), points (int), corrected (bool) and human_accuracy of each question,
+                with answer_code and kinki_mask encoded by utils.encode_answer and utils.choice_mask
+        """
+        key = (exam, str(year), section.lower())
+        if key not in self.questions:
+            if self.store is not None:
+                self.questions[key] = [self._build_question(problem) for problem in self.store.section(exam, year, section)]
+            else:
+                self.questions[key] = self._load(self.path(exam, year, section))
+        return self.questions[key]
+
+    def invalidate(self, exam=None, year=None):
+        """forget the parsed questions of an exam and year (every exam and year if None), so that the next get reads them again"""
+        for key in list(self.questions):
+            if (exam is None or key[0] == exam) and (year is None or key[1] == str(year)):
+                del self.questions[key]
+
+    def _load(self, path):
+        stat = os.stat(path)
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir, os.path.basename(path)[:-len(".json")] + ".pkl")
+            if os.path.exists(cache_path):
+                try:
+                    with open(cache_path, "rb") as f:
+                        cached = pickle.load(f)
+                        self.bytes_read += f.tell()
+                    if cached["version"] == CACHE_VERSION and cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                        return cached["questions"]
+                except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+                    pass # a broken cache is rebuilt from the json
+
+        with open(path, "r") as f:
+            questions = [self._build_question(problem) for problem in json.load(f)]
+        self.bytes_read += stat.st_size
+
+        if cache_path is not None:
+            # write to a temporary file first so that concurrent workers never read a partial cache
+            with atomic_write(cache_path, "wb") as f:
+                pickle.dump({"version": CACHE_VERSION, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "questions": questions}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return questions
+
+    @staticmethod
+    def _build_question(problem):
+        answer = normalize_answer(problem["answer"])
+        kinki = problem.get("kinki", "")
+        return {
+            "index": problem["index"],
+            "text_only": problem["text_only"],
+            "kinki": kinki,
+            "kinki_mask": choice_mask(kinki),
+            "subject": problem.get("answer_sub2"),
+            "answer": answer,
+            "answer_code": encode_answer(answer),
+            "points": int(problem["points"]),
+            "corrected": "corrected_question_index" in problem,
+            "human_accuracy": problem.get("human_accuracy"),
+        }
+
+
+# one index per (data_dir, cache_dir) in each process
+_indexes = {}
+
+
+def get_ground_truth_index(data_dir, cache_dir=None, exam_store=None):
+    """the ground truth index of data_dir shared by every Scoring instance of this process, read from the exam store at exam_store if given"""
+    key = (os.path.abspath(data_dir), cache_dir and os.path.abspath(cache_dir), exam_store and os.path.abspath(exam_store))
+    if key not in _indexes:
+        _indexes[key] = GroundTruthIndex(data_dir, cache_dir, open_store(exam_store, data_dir))
+    return _indexes[key]
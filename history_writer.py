@@ -0,0 +1,116 @@
+"""
+write the scoring history of a model as a single columnar table (Parquet or Arrow IPC) instead of one json per section
+"""
+
+import os
+from utils import to_float
+
+HISTORY_FORMATS = ["json", "parquet", "arrow"]
+HISTORY_FILES = {"parquet": "history.parquet", "arrow": "history.arrow"}
+
+
+def history_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("test_type", pa.string()),
+        ("year", pa.int32()),
+        ("section", pa.string()),
+        ("index", pa.string()),
+        ("text_only", pa.bool_()),
+        ("kinki", pa.string()), # only for the exams with forbidden choices
+        ("pred", pa.string()),
+        ("answer", pa.string()),
+        ("points", pa.int32()),
+        ("human_accuracy", pa.float64()),
+        ("subject", pa.string()), # only for 薬剤
+    ])
+
+
+class HistoryTableWriter:
+    def __init__(self, save_path, history_format, batch_size=50000, replaced_units=None):
+        """append the history of a (company, model, input_type) to save_path/history.parquet or history.arrow in batches
+        Args:
+            save_path (str): the path to save the scoring result of the model
+            history_format (str): parquet or arrow
+            batch_size (int): the number of rows buffered before a batch is written
+            replaced_units (set): (test_type, year) that are scored again. if given, the rows of the other units in the existing table are kept,
+                otherwise the table is overwritten. the set is read by close(), so the caller can remove the units that failed to score until then
+                and their old rows are kept
+        """
+        import pyarrow as pa
+
+        self.pa = pa
+        self.path = os.path.join(save_path, HISTORY_FILES[history_format])
+        self.schema = history_schema()
+        self.batch_size = batch_size
+        self.columns = {name: [] for name in self.schema.names}
+        self.n_buffered = 0
+
+        self.replaced_units = replaced_units
+        self.previous = None
+        if replaced_units is not None and os.path.exists(self.path):
+            # read into memory, the file is overwritten below
+            self.previous = read_history_table(save_path, history_format, memory_map=False)
+
+        if history_format == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(self.path, self.schema)
+
+    def append(self, test_type, history_data):
+        """buffer the history of one section, in the layout of the *_history.json files"""
+        for record in history_data:
+            self.columns["test_type"].append(test_type)
+            self.columns["year"].append(int(record["year"]))
+            self.columns["section"].append(record["section"])
+            self.columns["index"].append(str(record["index"]))
+            self.columns["text_only"].append(bool(record["text_only"]))
+            self.columns["kinki"].append(record.get("kinki"))
+            self.columns["pred"].append(record["pred"])
+            self.columns["answer"].append(record["answer"])
+            self.columns["points"].append(record["points"])
+            self.columns["human_accuracy"].append(to_float(record["human_accuracy"]))
+            self.columns["subject"].append(record.get("subject"))
+        self.n_buffered += len(history_data)
+        if self.n_buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        batch = self.pa.RecordBatch.from_pydict(self.columns, schema=self.schema)
+        self.writer.write_table(self.pa.Table.from_batches([batch]))
+        self.columns = {name: [] for name in self.schema.names}
+        self.n_buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.previous is not None:
+            keep = [(test_type, year) not in self.replaced_units
+                    for test_type, year in zip(self.previous.column("test_type").to_pylist(), self.previous.column("year").to_pylist())]
+            kept = self.previous.filter(self.pa.array(keep, type=self.pa.bool_()))
+            if kept.num_rows > 0:
+                self.writer.write_table(kept)
+            self.previous = None
+        self.writer.close()
+
+
+def read_history_table(save_path, history_format, memory_map=True):
+    """read the history table of a (company, model, input_type) as a pyarrow.Table
+    Args:
+        save_path (str): the path to the scoring result of the model
+        history_format (str): parquet or arrow
+        memory_map (bool): if True, an arrow table is read without copying from the memory-mapped file
+    """
+    import pyarrow as pa
+
+    path = os.path.join(save_path, HISTORY_FILES[history_format])
+    if history_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(path)
+    if memory_map:
+        return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    with pa.OSFile(path, "rb") as source:
+        return pa.ipc.open_file(source).read_all()
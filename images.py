@@ -0,0 +1,86 @@
+"""
+load the figures of the exam questions for the multimodal runs, resized to the limit of the model and cached on disk as base64 data urls,
+so that every model and rerun reads the encoded images instead of encoding them again
+"""
+
+import os
+import base64
+import threading
+from utils import atomic_write, file_sha256
+
+# the fields of a question that list its figures, relative to the directory of the exam
+IMAGE_KEYS = ["images", "image", "figures"]
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".gif": "image/gif", ".webp": "image/webp"}
+
+
+def question_images(problem):
+    """the paths of the figures of a question relative to the directory of its exam, empty if it has none"""
+    for key in IMAGE_KEYS:
+        value = problem.get(key)
+        if value:
+            return [value] if isinstance(value, str) else list(value)
+    return []
+
+
+class ImageCache:
+    def __init__(self, cache_dir, max_side=None, image_format="JPEG", quality=90):
+        """the encoded figures, one base64 data url per (image, size) in cache_dir
+        Args:
+            cache_dir (str): the path to keep the encoded images
+            max_side (int): the longest side in pixels the images are shrunk to, as the model allows. None to send them as they are, which does not need PIL
+            image_format (str): JPEG or PNG, the format of the resized images
+            quality (int): the JPEG quality of the resized images
+        """
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.hits = 0
+        self.misses = 0
+        # the images are encoded in the threads of the inference run, the requests of the same image wait for the first one
+        self.locks = {}
+        self.locks_guard = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path):
+        """the key of an image at the size of this cache, from the hash of its content so that renamed or copied figures share it"""
+        size = "original" if self.max_side is None else f"{self.max_side}{self.image_format.lower()}{self.quality}"
+        return f"{file_sha256(path)}_{size}"
+
+    def data_url(self, path):
+        """the data url of an image, encoded once and read from the cache file afterwards"""
+        key = self.key(path)
+        cache_path = os.path.join(self.cache_dir, key + ".b64")
+        with self.locks_guard:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            if os.path.exists(cache_path):
+                self.hits += 1
+                with open(cache_path, "r", encoding="ascii") as f:
+                    return f.read()
+            return self._encode_to_cache(path, cache_path)
+
+    def _encode_to_cache(self, path, cache_path):
+        self.misses += 1
+        mime_type, data = self._encode(path)
+        url = f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+        # write to a temporary file first so that concurrent runs never read a partial image
+        with atomic_write(cache_path, "wb") as f:
+            f.write(url.encode("ascii"))
+        return url
+
+    def _encode(self, path):
+        if self.max_side is None:
+            with open(path, "rb") as f:
+                return MIME_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream"), f.read()
+
+        import io
+        from PIL import Image
+
+        with Image.open(path) as image:
+            image.thumbnail((self.max_side, self.max_side)) # only shrinks, keeps the aspect ratio
+            if self.image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, format=self.image_format, quality=self.quality)
+        return f"image/{self.image_format.lower()}", buffer.getvalue()
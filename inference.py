@@ -0,0 +1,427 @@
+"""
+test an LLM on the exams through an OpenAI-compatible chat completions endpoint with the prompts in prompt.py,
+and write its answers to results/ in the format calculate_scores.py reads
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from prompt import SYSTEM_MESSAGE_TEMPLATE, NUMBER_QUESTION_PROMPT, LETTER_QUESTION_PROMPT, NUMBER_EXPLAIN_PROMPT, LETTER_EXPLAIN_PROMPT, PACKED_EXPLAIN_PROMPT
+from utils import ROLE_MAP, TEST_TYPE_MAP, atomic_write
+from exam_rules import EXAM_RULES, YEARS
+from response_cache import ResponseCache, request_key
+from journal import Journal, JOURNAL_NAME
+from scheduler import ScheduledRequest, PrefixScheduler
+from images import ImageCache, question_images
+from exam_store import open_store
+
+# the status codes worth retrying, the others (e.g. 400 for a bad request) fail at once
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+PACKED_ANSWERS_PATTERN = re.compile(r'\[.*\]', re.DOTALL)
+
+
+def question_style(problem):
+    """letter if the choices of a question are a, b, c, ..., number if they are 1, 2, 3, ... (or there are none)"""
+    return "letter" if "a" in problem else "number"
+
+
+def build_system_message(exam, style, packed=False):
+    """SYSTEM_MESSAGE_TEMPLATE filled for one exam and one style of choices, with PACKED_EXPLAIN_PROMPT if several questions are sent at once"""
+    question_prompt, explain_prompt = (LETTER_QUESTION_PROMPT, LETTER_EXPLAIN_PROMPT) if style == "letter" else (NUMBER_QUESTION_PROMPT, NUMBER_EXPLAIN_PROMPT)
+    if packed:
+        explain_prompt += PACKED_EXPLAIN_PROMPT
+    return SYSTEM_MESSAGE_TEMPLATE.replace("[role]", ROLE_MAP[exam]).replace("[test_type]", TEST_TYPE_MAP[exam]) \
+        .replace("[question_prompt]", question_prompt.strip("\n")).replace("[explain_prompt]", explain_prompt)
+
+
+def question_content(problem):
+    """the question and its choices in the json layout of the question prompts"""
+    content = {"question": problem["question"]}
+    for key, value in problem.items():
+        # the choices are the single letter or digit keys, the rest is metadata of the question
+        if len(key) == 1 and key.isalnum():
+            content[key] = value
+    return content
+
+
+def build_user_message(problem):
+    return json.dumps(question_content(problem), ensure_ascii=False, indent=4)
+
+
+def build_messages(exam, problem):
+    return [
+        {"role": "system", "content": build_system_message(exam, question_style(problem))},
+        {"role": "user", "content": build_user_message(problem)},
+    ]
+
+
+def build_packed_messages(exam, problems):
+    """one request for several questions of the same style, given as a json list and answered as a json list"""
+    return [
+        {"role": "system", "content": build_system_message(exam, question_style(problems[0]), packed=True)},
+        {"role": "user", "content": json.dumps([question_content(problem) for problem in problems], ensure_ascii=False, indent=4)},
+    ]
+
+
+def attach_images(messages, image_urls):
+    """the messages with the images appended to the user message, in the layout of the OpenAI vision api"""
+    user = messages[-1]
+    content = [{"type": "text", "text": user["content"]}] + [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+    return messages[:-1] + [{**user, "content": content}]
+
+
+def parse_packed_answers(content, n_questions):
+    """the answers of a packed request, None if the reply is not a json list of n_questions answers"""
+    match = PACKED_ANSWERS_PATTERN.search(content)
+    if match is None:
+        return None
+    try:
+        answers = json.loads(match.group())
+    except ValueError:
+        return None
+    if not isinstance(answers, list) or len(answers) != n_questions:
+        return None
+    parsed = []
+    for answer in answers:
+        if isinstance(answer, list): # ["A", "C"] for AC
+            answer = "".join(str(choice) for choice in answer)
+        elif isinstance(answer, dict):
+            return None
+        parsed.append(str(answer))
+    return parsed
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """limit the requests to rate per second on average, with bursts of up to capacity
+        Args:
+            rate (float): the tokens added per second
+            capacity (float): the maximum number of tokens, defaults to rate
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class InferenceClient:
+    def __init__(self, base_url, model, api_key=None, max_concurrency=8, requests_per_second=None, max_retries=5, backoff=1.0, timeout=120,
+                 temperature=0.0, max_tokens=None, cache=None):
+        """send chat completion requests with bounded concurrency, rate limiting and retry with exponential backoff
+        Args:
+            base_url (str): the base url of the endpoint, e.g. http://localhost:8000/v1
+            model (str): the name of the model at the endpoint
+            api_key (str): sent as a bearer token if given
+            max_concurrency (int): the maximum number of requests in flight
+            requests_per_second (float): the average request rate, None for no limit
+            max_retries (int): the number of retries of a failed request
+            backoff (float): the delay before the first retry in seconds, doubled at each retry
+            timeout (float): the timeout of a request in seconds
+            temperature (float): the sampling temperature
+            max_tokens (int): the maximum number of generated tokens, None for the default of the endpoint
+            cache (ResponseCache): the replies already received, consulted before any request. None to always send
+        """
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # urllib blocks, so each request runs in a thread. one thread per request in flight
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.cache = cache
+        self.in_flight = {} # cache key -> the task sending that request, so that identical questions are sent once
+        self.n_requests = 0
+
+    def _post(self, payload):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode(), headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    async def complete(self, messages, image_digests=()):
+        """the content of the reply to messages
+        Args:
+            messages (dict[]): the chat messages
+            image_digests (str[]): the digests of the images in messages, part of the cache key
+        Raises:
+            urllib.error.URLError: if the request still fails after max_retries retries
+        """
+        payload = {"model": self.model, "messages": messages, "temperature": self.temperature}
+        if self.max_tokens is not None:
+            payload["max_tokens"] = self.max_tokens
+
+        if self.cache is None:
+            return await self._send(payload)
+
+        key = request_key(payload, image_digests)
+        content = self.cache.get(key)
+        if content is not None:
+            return content
+        if key not in self.in_flight:
+            self.in_flight[key] = asyncio.ensure_future(self._send(payload))
+        task = self.in_flight[key]
+        try:
+            content = await asyncio.shield(task)
+        finally:
+            self.in_flight.pop(key, None)
+        if not self.cache.contains(key):
+            self.cache.put(key, content, self.model)
+        return content
+
+    async def _send(self, payload):
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            try:
+                async with self.semaphore:
+                    self.n_requests += 1
+                    response = await asyncio.get_running_loop().run_in_executor(self.executor, self._post, payload)
+                return response["choices"][0]["message"]["content"] or ""
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUS or attempt == self.max_retries:
+                    raise
+                retry_after = e.headers.get("Retry-After") if e.headers else None
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff * 2 ** attempt
+            except (urllib.error.URLError, TimeoutError, ConnectionError):
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            # jitter, so that the requests that failed together are not retried together
+            await asyncio.sleep(delay * (0.5 + random.random()))
+
+
+def has_questions(data_dir, exam, year, section, store=None):
+    if store is not None:
+        return store.has_section(exam, year, section)
+    return os.path.exists(os.path.join(data_dir, exam, f"{exam}_{year}_{section.lower()}.json"))
+
+
+def load_questions(data_dir, exam, year, section, store=None):
+    """the questions of one section as they are in the exam json, read from the exam store if given"""
+    if store is not None:
+        return store.section(exam, year, section)
+    with open(os.path.join(data_dir, exam, f"{exam}_{year}_{section.lower()}.json"), "r") as f:
+        return json.load(f)
+
+
+def write_predictions(path, predictions):
+    # write to a temporary file first so that an interrupted run never leaves a partial prediction file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write(path) as f:
+        json.dump(predictions, f, indent=4, ensure_ascii=False)
+
+
+class SectionState:
+    def __init__(self, exam, year, section, questions):
+        """the answers of one section as they arrive, written to its prediction file once all are in"""
+        self.exam = exam
+        self.year = year
+        self.section = section
+        self.questions = questions
+        self.preds = [None] * len(questions)
+        self.packs = [None] * len(questions) # the number of questions of the request of each answer, when packing
+        self.remaining = len(questions)
+        self.error = None
+
+    def write(self, answer_res_path):
+        predictions = []
+        for problem, pred, pack in zip(self.questions, self.preds, self.packs):
+            prediction = {"index": problem["index"], "pred": pred}
+            if pack is not None:
+                prediction["pack"] = pack
+            predictions.append(prediction)
+        write_predictions(os.path.join(answer_res_path, self.exam, f"{self.exam}_{self.year}_{self.section.lower()}_pred.json"), predictions)
+
+
+def single_or_packed_request(state, positions, image_cache=None, data_dir=None):
+    """the request of some questions of a section, tagged with the section and their positions.
+    with image_cache, the figures of the questions (under data_dir/<exam>) are attached when the request is sent, run never packs the questions with figures"""
+    problems = [state.questions[position] for position in positions]
+    messages = build_messages(state.exam, problems[0]) if len(problems) == 1 else build_packed_messages(state.exam, problems)
+    image_paths = [os.path.join(data_dir, state.exam, image) for problem in problems for image in question_images(problem)] if image_cache is not None else []
+    if not image_paths:
+        return ScheduledRequest(messages, (state, positions))
+    return ScheduledRequest(messages, (state, positions), [image_cache.key(path) for path in image_paths],
+                            lambda: attach_images(messages, [image_cache.data_url(path) for path in image_paths]))
+
+
+async def run(client, data_dir, answer_res_path, exams=None, years=YEARS, overwrite=False, resume=True, scheduler=None, pack_size=1, image_cache=None, store=None,
+              restart=False):
+    """answer every section of the exams, the requests of all the sections go through one scheduler and share the limits of the client
+    Args:
+        client (InferenceClient): the client of the endpoint
+        data_dir (str): the path to the exam data
+        answer_res_path (str): results/<company>/<model>/<input_type>
+        exams (str[]): the exams to answer, defaults to all in EXAM_RULES
+        years (int[]): the years to answer
+        overwrite (bool): if False, the sections that already have a prediction file are skipped
+        resume (bool): if True, every answer is journaled to answer_res_path/journal.jsonl and the answers of an interrupted run are reused.
+            the journal is removed once every section is written
+        scheduler (PrefixScheduler): the order the requests are sent in, defaults to grouping them by system message, see scheduler.py
+        pack_size (int): the number of questions of a section sent in one request. the questions of a request that cannot be parsed are sent again one by one.
+            if more than 1, each prediction records the number of questions of its request as "pack". the questions with figures are always sent alone
+        image_cache (ImageCache): if given, the figures of the questions are attached to their requests, for the multimodal runs
+        store (ExamStore): if given, the questions are read from it instead of the json files in data_dir, see exam_store.py
+        restart (bool): if True, the journal of an interrupted run is dropped instead of resumed. overwrite alone keeps it, so that an interrupted
+            overwrite run resumes when it is run again
+    Returns:
+        failures (list): (exam, year, section, error) of the sections that failed, the other sections are written anyway
+    """
+    jobs = []
+    for exam in exams or EXAM_RULES.keys():
+        for year in years:
+            for section in EXAM_RULES[exam]["sections"]:
+                if not has_questions(data_dir, exam, year, section, store):
+                    continue
+                if not overwrite and os.path.exists(os.path.join(answer_res_path, exam, f"{exam}_{year}_{section.lower()}_pred.json")):
+                    continue
+                jobs.append((exam, year, section))
+
+    journal = Journal(os.path.join(answer_res_path, JOURNAL_NAME), reset=restart) if resume else None
+    if scheduler is None:
+        scheduler = PrefixScheduler(client.max_concurrency)
+
+    states = []
+    requests = []
+    n_resumed = 0
+    for exam, year, section in jobs:
+        state = SectionState(exam, year, section, load_questions(data_dir, exam, year, section, store))
+        pending = {} # style -> the positions to ask
+        for position, problem in enumerate(state.questions):
+            record = journal.get(exam, year, section, position, problem["index"]) if journal is not None else None
+            if record is not None:
+                state.preds[position] = record["pred"]
+                state.packs[position] = record.get("pack")
+                state.remaining -= 1
+                n_resumed += 1
+            else:
+                pending.setdefault(question_style(problem), []).append(position)
+        for positions in pending.values():
+            if image_cache is not None and pack_size > 1:
+                # the figures of a packed request could not be told apart, the questions with figures are asked one by one
+                with_images = {position for position in positions if question_images(state.questions[position])}
+                requests.extend(single_or_packed_request(state, [position], image_cache, data_dir) for position in sorted(with_images))
+                positions = [position for position in positions if position not in with_images]
+            for start in range(0, len(positions), pack_size):
+                requests.append(single_or_packed_request(state, positions[start:start + pack_size], image_cache, data_dir))
+        if state.remaining == 0:
+            state.write(answer_res_path)
+        states.append(state)
+
+    fallback = [] # the single requests of the questions whose packed reply could not be parsed
+
+    def on_done(request, content, error):
+        state, positions = request.tag
+        if error is not None:
+            state.remaining -= len(positions)
+            state.error = state.error or error
+            return
+
+        if len(positions) == 1:
+            answers = [content]
+        else:
+            answers = parse_packed_answers(content, len(positions))
+            if answers is None:
+                fallback.extend(single_or_packed_request(state, [position], image_cache, data_dir) for position in positions)
+                return
+        pack = len(positions) if pack_size > 1 else None
+        for position, answer in zip(positions, answers):
+            state.preds[position] = answer
+            state.packs[position] = pack
+        if journal is not None:
+            journal.append(state.exam, state.year, state.section, [(position, state.questions[position]["index"], answer) for position, answer in zip(positions, answers)], pack)
+        state.remaining -= len(positions)
+        if state.remaining == 0 and state.error is None:
+            state.write(answer_res_path)
+
+    await scheduler.run(client, requests, on_done)
+    n_fallback = len(fallback)
+    if fallback:
+        await scheduler.run(client, fallback, on_done)
+
+    failures = [(state.exam, state.year, state.section, state.error) for state in states if state.error is not None]
+    if journal is not None:
+        journal.close(remove=not failures)
+
+    n_questions = sum(len(state.questions) for state in states if state.error is None)
+    print(f"Answered {n_questions} questions in {len(jobs) - len(failures)}/{len(jobs)} sections" + (f", {n_resumed} resumed from {JOURNAL_NAME}" if n_resumed else ""))
+    if pack_size > 1:
+        n_packed = sum(len(request.tag[1]) for request in requests)
+        print(f"Packed {n_packed} questions into {len(requests)} requests ({n_packed / max(len(requests), 1):.2f} per request), {n_fallback} sent again one by one")
+    if client.cache is not None:
+        print(f"Response cache: {client.cache.hits} hits, {client.n_requests} requests sent")
+    if image_cache is not None:
+        print(f"Image cache: {image_cache.hits} hits, {image_cache.misses} images encoded")
+    for exam, year, section, error in failures:
+        print(f"Failed {exam} {year} {section}: {error!r}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="test an LLM on the exams through an OpenAI-compatible endpoint")
+    parser.add_argument("--base_url", type=str, required=True, help="e.g. http://localhost:8000/v1, see mock_server.py for a local stub")
+    parser.add_argument("--model", type=str, required=True, help="the name of the model at the endpoint")
+    parser.add_argument("--company", type=str, required=True, help="the company directory under results/")
+    parser.add_argument("--model_dir", type=str, default=None, help="the model directory under results/, defaults to --model")
+    parser.add_argument("--input_type", type=str, default="text", help="multimodal attaches the figures of the questions")
+    parser.add_argument("--exams", type=str, nargs="*", default=None, choices=list(EXAM_RULES.keys()))
+    parser.add_argument("--years", type=int, nargs="*", default=list(YEARS))
+    parser.add_argument("--api_key", type=str, default=os.environ.get("OPENAI_API_KEY"))
+    parser.add_argument("--max_concurrency", type=int, default=8)
+    parser.add_argument("--pack_size", type=int, default=1, help="the number of questions of a section sent in one request, answered as a json list")
+    parser.add_argument("--batch_size", type=int, default=None, help="send the requests in batches of this size instead of keeping --max_concurrency in flight, see scheduler.py")
+    parser.add_argument("--requests_per_second", type=float, default=None)
+    parser.add_argument("--max_retries", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--overwrite", action="store_true", help="answer the sections that already have a prediction file again")
+    parser.add_argument("--no_resume", action="store_true", help="do not journal the answers, an interrupted run starts the unfinished sections over")
+    parser.add_argument("--restart", action="store_true", help="drop the journal of an interrupted run and ask its questions again")
+    parser.add_argument("--cache_dir", type=str, default="./.response_cache", help="the path to cache the replies by the hash of the request")
+    parser.add_argument("--cache_size_gb", type=float, default=1.0, help="the size of the cache, the least recently used replies are evicted beyond it")
+    parser.add_argument("--no_cache", action="store_true", help="send every request even if its reply is cached")
+    parser.add_argument("--image_max_side", type=int, default=None, help="shrink the figures to this many pixels on the longer side (needs PIL), as the model allows")
+    parser.add_argument("--image_cache_dir", type=str, default="./.image_cache", help="the path to cache the encoded figures by their hash and size")
+    parser.add_argument("--exam_store", type=str, default=None, help="read the questions from the SQLite file built by exam_store.py, e.g. ./exams/exams.sqlite")
+    parser.add_argument("--data_dir", type=str, default="./exams/JA")
+    parser.add_argument("--res_dir", type=str, default="./results")
+    args = parser.parse_args()
+
+    async def main():
+        cache = None if args.no_cache else ResponseCache(args.cache_dir, int(args.cache_size_gb * (1 << 30)))
+        client = InferenceClient(args.base_url, args.model, args.api_key, args.max_concurrency, args.requests_per_second, args.max_retries, timeout=args.timeout,
+                                 cache=cache)
+        answer_res_path = os.path.join(args.res_dir, args.company, args.model_dir or args.model, args.input_type)
+        scheduler = PrefixScheduler(args.max_concurrency, args.batch_size)
+        return await run(client, args.data_dir, answer_res_path, args.exams, args.years, args.overwrite, not args.no_resume, scheduler, args.pack_size,
+                         ImageCache(args.image_cache_dir, args.image_max_side) if args.input_type == "multimodal" else None, open_store(args.exam_store, args.data_dir),
+                         restart=args.restart)
+
+    asyncio.run(main())
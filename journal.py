@@ -0,0 +1,74 @@
+"""
+a write-ahead journal of the answered questions of an inference run, so that an interrupted run resumes where it stopped
+"""
+
+import os
+import json
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+class Journal:
+    def __init__(self, path, reset=False):
+        """append each answer to a JSONL file and fsync it before it counts as done
+        the records are {"test_type", "year", "section", "position", "index", "pred"}, the layout of predictions.jsonl plus the position of the question in its section,
+        and "pack", the number of questions of the request, when the questions were packed
+        Args:
+            path (str): the path to the journal, usually results/<company>/<model>/<input_type>/journal.jsonl
+            reset (bool): if True, the answers of the previous runs are dropped, see inference.py --restart
+        """
+        self.path = path
+        self.done = {} # (test_type, year, section, position) -> record
+        if reset and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            self._replay()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a")
+
+    def _replay(self):
+        with open(self.path, "r") as f:
+            lines = f.readlines()
+        valid_size = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a run killed while writing, the answer is asked again
+                break
+            self.done[(record["test_type"], str(record["year"]), record["section"].lower(), record["position"])] = record
+            valid_size += len(line.encode())
+        if valid_size != os.path.getsize(self.path):
+            with open(self.path, "r+") as f:
+                f.truncate(valid_size)
+
+    def get(self, test_type, year, section, position, index):
+        """the journaled record of a question, None if it was not answered yet or the question at that position changed since"""
+        record = self.done.get((test_type, str(year), section.lower(), position))
+        if record is None or str(record["index"]) != str(index):
+            return None
+        return record
+
+    def append(self, test_type, year, section, answers, pack=None):
+        """journal the answers of one request with a single fsync
+        Args:
+            answers (tuple[]): (position, index, pred) of each question
+            pack (int): the number of questions packed in the request, None if it was not packed
+        """
+        records = []
+        for position, index, pred in answers:
+            record = {"test_type": test_type, "year": int(year), "section": section.lower(), "position": position, "index": index, "pred": pred}
+            if pack is not None:
+                record["pack"] = pack
+            records.append(record)
+        self.file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        for record in records:
+            self.done[(test_type, str(year), section.lower(), record["position"])] = record
+
+    def close(self, remove=False):
+        """close the journal, remove (after every section is written to its prediction file) to start the next run afresh"""
+        self.file.close()
+        if remove:
+            os.remove(self.path)
@@ -0,0 +1,66 @@
+"""
+record what each scoring result was computed from, so that unchanged units can be skipped on re-run
+"""
+
+import os
+import csv
+import glob
+import json
+import hashlib
+from predictions import prediction_files
+from utils import atomic_write, file_sha256
+
+MANIFEST_NAME = "manifest.json"
+
+
+def unit_digest(data_dir, answer_res_path, test_type, year, scoring_version, fix_format=False, store=None):
+    """the hash of everything one (exam, year) unit of a model is scored from
+    Args:
+        data_dir (str): the path to the ground truth data
+        answer_res_path (str): the path to the answer of the LLM
+        test_type (str): the type of the exam
+        year (int): the year of the exam
+        scoring_version (str): the version of the scoring rules
+        fix_format (bool): whether the format of the answers is fixed
+        store (ExamStore): if given, the hashes of the ground truth files are read from it, they are the same as hashing the json files
+    Returns:
+        digest (str): a sha256 over the scoring version, the ground truth files and the prediction files
+    """
+    digest = hashlib.sha256(f"{scoring_version}|{fix_format}".encode())
+    if store is not None:
+        file_digests = store.file_digests(test_type, year)
+    else:
+        file_digests = [(os.path.basename(path), file_sha256(path)) for path in sorted(glob.glob(os.path.join(data_dir, test_type, f"{test_type}_{year}_*.json")))]
+    file_digests += [(os.path.basename(path), file_sha256(path)) for path in prediction_files(answer_res_path, test_type, year)]
+    for name, sha256 in file_digests:
+        digest.update(f"|{name}:{sha256}".encode())
+    return digest.hexdigest()
+
+
+def load_manifest(save_path):
+    """the manifest of a (company, model, input_type), empty if it was never scored incrementally"""
+    path = os.path.join(save_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"units": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(save_path, manifest):
+    # write to a temporary file first so that an interrupted run never leaves a broken manifest
+    with atomic_write(os.path.join(save_path, MANIFEST_NAME)) as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False, sort_keys=True)
+
+
+def read_total_scores(csv_path):
+    """the rows of an existing total_scores.csv by year, with the cells kept as written"""
+    if not os.path.exists(csv_path):
+        return {}
+    rows = {}
+    with open(csv_path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            # empty cells are the pharmacy subjects that do not appear in that year
+            row = {key: value for key, value in row.items() if value != ""}
+            row["year"] = int(row["year"])
+            rows[row["year"]] = row
+    return rows
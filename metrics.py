@@ -0,0 +1,126 @@
+"""
+opt-in timings of the stages of the scoring (reading the ground truth and the predictions, normalizing, scoring, writing) per (company, model, input_type, exam, year),
+written as a JSON summary and a Prometheus textfile, and a cProfile hook for a single unit
+"""
+
+import os
+import json
+import time
+import pstats
+import cProfile
+from contextlib import contextmanager
+from utils import atomic_write
+
+METRICS_JSON = "metrics.json"
+METRICS_PROM = "metrics.prom"
+FIELDS = ["seconds", "calls", "items", "bytes"]
+
+
+class _Record:
+    """the counts of one call of a stage, filled in by the code inside the with block"""
+    __slots__ = ["items", "bytes"]
+
+    def __init__(self):
+        self.items = 0
+        self.bytes = 0
+
+    def add(self, items=0, n_bytes=0):
+        self.items += items
+        self.bytes += n_bytes
+
+
+class StageMetrics:
+    def __init__(self, enabled=True):
+        """the seconds, calls, items and bytes of each (stage, unit)
+        Args:
+            enabled (bool): if False, stage() does nothing, so that the instrumented code costs nothing when the metrics are not asked for
+        """
+        self.enabled = enabled
+        self.unit = None # the unit the stages are recorded for, set by the caller, e.g. Scoring.score
+        self.stages = {} # (stage, unit) -> [seconds, calls, items, bytes]
+
+    @contextmanager
+    def stage(self, name, unit=None):
+        """time the with block as one call of the stage, the block can count what it handled with record.add(items, n_bytes)"""
+        record = _Record()
+        if not self.enabled:
+            yield record
+            return
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            totals = self.stages.setdefault((name, unit if unit is not None else self.unit), [0.0, 0, 0, 0])
+            totals[0] += time.perf_counter() - start
+            totals[1] += 1
+            totals[2] += record.items
+            totals[3] += record.bytes
+
+    def pop(self):
+        """the records so far as a picklable list, to send from a worker process to merge(), and start afresh"""
+        records = [(name, unit, values) for (name, unit), values in self.stages.items()]
+        self.stages = {}
+        return records
+
+    def merge(self, records):
+        for name, unit, values in records:
+            totals = self.stages.setdefault((name, unit), [0.0, 0, 0, 0])
+            for i, value in enumerate(values):
+                totals[i] += value
+
+    def summary(self):
+        """the totals of each stage and the stages of each unit, units are joined with / e.g. company/model/text/医師/2024"""
+        stages = {}
+        units = {}
+        for (name, unit), values in sorted(self.stages.items(), key=lambda item: (item[0][0], _unit_label(item[0][1]))):
+            totals = stages.setdefault(name, dict.fromkeys(FIELDS, 0))
+            for field, value in zip(FIELDS, values):
+                totals[field] += value
+            if unit is not None:
+                units.setdefault(_unit_label(unit), {})[name] = dict(zip(FIELDS, values))
+        return {"stages": stages, "units": units}
+
+    def write(self, metrics_dir):
+        """write metrics.json and metrics.prom (for the textfile collector of node_exporter) to metrics_dir, each replaced atomically"""
+        os.makedirs(metrics_dir, exist_ok=True)
+        summary = self.summary()
+        with atomic_write(os.path.join(metrics_dir, METRICS_JSON)) as f:
+            json.dump(summary, f, indent=4, ensure_ascii=False)
+
+        lines = []
+        for field in FIELDS:
+            metric = f"kokushi_scoring_stage_{field}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for name, totals in summary["stages"].items():
+                lines.append(f'{metric}{{stage="{name}"}} {totals[field]}')
+        metric = "kokushi_scoring_unit_seconds"
+        lines.append(f"# TYPE {metric} gauge")
+        for (name, unit), values in sorted(self.stages.items(), key=lambda item: (item[0][0], _unit_label(item[0][1]))):
+            if unit is None:
+                continue
+            labels = ",".join(f'{key}="{_escape(value)}"' for key, value in zip(["company", "model", "input_type", "exam", "year"], unit))
+            lines.append(f'{metric}{{stage="{name}",{labels}}} {values[0]}')
+        with atomic_write(os.path.join(metrics_dir, METRICS_PROM)) as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def _unit_label(unit):
+    return "" if unit is None else "/".join(str(part) for part in unit)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+@contextmanager
+def profiled(path, top=25):
+    """run the with block under cProfile, save the stats to path (for snakeviz or pstats) and print the top functions by cumulative time"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
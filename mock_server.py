@@ -0,0 +1,136 @@
+"""
+a local stub of an OpenAI-compatible chat completions endpoint, to test inference.py without a real model
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def first_choice(question):
+    choices = [key for key in question if key != "question"]
+    return choices[0].upper() if choices else "1"
+
+
+def mock_answer(messages):
+    """the first choice of the question in the last user message, in the style the prompts ask for (AC or 13).
+    a json list of the first choices if the questions are packed in a list"""
+    try:
+        content = messages[-1]["content"]
+        if isinstance(content, list): # text and images
+            content = "".join(part.get("text", "") for part in content)
+        content = json.loads(content)
+    except (ValueError, KeyError, TypeError, IndexError):
+        return "1"
+    if isinstance(content, list):
+        return json.dumps([first_choice(question) for question in content], ensure_ascii=False)
+    return first_choice(content)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # set by serve, each server has its own subclass and counters
+    latency = 0.0
+    failure_rate = 0.0
+    prefill_latency = 0.0
+    prefix_cache_size = 0
+    lock = threading.Lock()
+    prefill_lock = threading.Lock()
+    n_requests = 0
+    prefix_hits = 0
+    prefix_cache = OrderedDict()
+    # the headers and the body in one segment, so that small replies are not held back by delayed ACKs
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = body.get("messages", [])
+        system = messages[0]["content"] if messages and messages[0].get("role") == "system" else ""
+        cls = type(self)
+        with cls.lock:
+            cls.n_requests += 1
+            # the system messages whose KV cache the server would still hold, least recently used first
+            hit = system in cls.prefix_cache
+            if hit:
+                cls.prefix_hits += 1
+                cls.prefix_cache.move_to_end(system)
+            elif cls.prefix_cache_size:
+                cls.prefix_cache[system] = True
+                while len(cls.prefix_cache) > cls.prefix_cache_size:
+                    cls.prefix_cache.popitem(last=False)
+
+        if not hit and self.prefill_latency:
+            # the prefill of an uncached prefix takes the whole (simulated) accelerator, one at a time
+            with cls.prefill_lock:
+                time.sleep(self.prefill_latency * len(system) / 1000)
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            # a transient failure the client should retry
+            self.send_response(random.choice([429, 503]))
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        reply = {
+            "id": f"mock-{cls.n_requests}",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": mock_answer(body.get("messages", []))}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 1, "total_tokens": 1},
+        }
+        data = json.dumps(reply, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # no log per request
+
+
+def serve(host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, prefill_latency=0.0, prefix_cache_size=0):
+    """start the stub in a background thread
+    Args:
+        host (str): the address to listen on
+        port (int): the port to listen on, 0 for any free port
+        latency (float): the seconds each reply is delayed
+        failure_rate (float): the fraction of requests answered with 429 or 503
+        prefill_latency (float): the extra seconds per 1000 characters of a system message that is not in the prefix cache, the prefills are serialized
+        prefix_cache_size (int): the number of system messages the simulated prefix cache holds
+    Returns:
+        server (ThreadingHTTPServer): the running server, its base url is f"http://{host}:{server.server_port}/v1". call server.shutdown() to stop it.
+            server.RequestHandlerClass holds the counters n_requests and prefix_hits
+    """
+    handler = type("Handler", (MockHandler,), {
+        "latency": latency, "failure_rate": failure_rate, "prefill_latency": prefill_latency, "prefix_cache_size": prefix_cache_size,
+        "lock": threading.Lock(), "prefill_lock": threading.Lock(), "n_requests": 0, "prefix_hits": 0, "prefix_cache": OrderedDict(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="a local stub of an OpenAI-compatible chat completions endpoint")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="the seconds each reply is delayed")
+    parser.add_argument("--failure_rate", type=float, default=0.0, help="the fraction of requests answered with 429 or 503")
+    parser.add_argument("--prefill_latency", type=float, default=0.0, help="the extra seconds per 1000 characters of a system message that is not in the prefix cache")
+    parser.add_argument("--prefix_cache_size", type=int, default=0, help="the number of system messages the simulated prefix cache holds")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.failure_rate, args.prefill_latency, args.prefix_cache_size)
+    print(f"Serving on http://{args.host}:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,173 @@
+"""
+read the predictions of an LLM from the json arrays in results/ or from streamed JSONL files
+
+the predictions of one section can be given as
+    <exam>/<exam>_<year>_<section>_pred.json   a json array of {"pred": ...}, one per question
+    <exam>/<exam>_<year>_<section>_pred.jsonl  one {"pred": ...} per line
+or the predictions of all the exams of a model and input type as
+    predictions.jsonl                          one {"test_type": ..., "year": ..., "section": ..., "index": ..., "pred": ...} per line
+the JSONL records can carry any other fields (raw generations, metadata, ...), only index and pred are kept.
+if a record has a "sample" field, only the records of the selected sample are kept.
+"""
+
+import os
+import json
+from collections import OrderedDict
+
+PREDICTIONS_JSONL = "predictions.jsonl"
+
+# the routed predictions of the last few predictions.jsonl files, {path: (mtime_ns, size, sample, {(exam, year, section): [...]})}
+_routed = OrderedDict()
+_MAX_ROUTED = 2
+
+
+def iter_jsonl(path):
+    """yield the records of a JSONL file one line at a time"""
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _slim(record):
+    # only what scoring needs, so that memory does not grow with the size of the generations
+    return {"index": record.get("index"), "pred": record["pred"]}
+
+
+def _route(path, sample):
+    """split a predictions.jsonl into the predictions of each (exam, year, section) in a single pass"""
+    stat = os.stat(path)
+    cached = _routed.get(path)
+    if cached is not None and cached[:3] == (stat.st_mtime_ns, stat.st_size, sample):
+        _routed.move_to_end(path)
+        return cached[3]
+
+    routes = {}
+    for record in iter_jsonl(path):
+        if record.get("sample", 0) != sample:
+            continue
+        key = (record.get("test_type", record.get("exam")), str(record["year"]), str(record["section"]).lower())
+        routes.setdefault(key, []).append(_slim(record))
+
+    _routed[path] = (stat.st_mtime_ns, stat.st_size, sample, routes)
+    while len(_routed) > _MAX_ROUTED:
+        _routed.popitem(last=False)
+    return routes
+
+
+def route_predictions(answer_res_path, sample=0):
+    """the predictions.jsonl of a model split by (exam, year, section), None if the model has no predictions.jsonl.
+    callers that read many models exam by exam keep the result per model and pass it to load_predictions,
+    the cache of load_predictions only holds the last few files
+    """
+    jsonl_path = os.path.join(answer_res_path, PREDICTIONS_JSONL)
+    if not os.path.exists(jsonl_path):
+        return None
+    return _route(jsonl_path, sample)
+
+
+def prediction_files(answer_res_path, test_type, year):
+    """the files the predictions of an exam and year can be read from, used to detect changes"""
+    files = []
+    exam_dir = os.path.join(answer_res_path, test_type)
+    if os.path.isdir(exam_dir):
+        prefix = f"{test_type}_{year}_"
+        files.extend(os.path.join(exam_dir, name) for name in sorted(os.listdir(exam_dir)) if name.startswith(prefix) and (name.endswith("_pred.json") or name.endswith("_pred.jsonl")))
+    if os.path.exists(os.path.join(answer_res_path, PREDICTIONS_JSONL)):
+        files.append(os.path.join(answer_res_path, PREDICTIONS_JSONL))
+    return files
+
+
+def load_predictions(answer_res_path, test_type, year, section, sample=0, routes=None):
+    """the predictions of one section of an exam
+    Args:
+        answer_res_path (str): the path to the answer of the LLM
+        test_type (str): the type of the exam
+        year (int): the year of the exam
+        section (str): the section of the exam
+        sample (int): the sample to score when the JSONL records have a "sample" field
+        routes (dict): the predictions.jsonl of the model from route_predictions, read again if None
+    Returns:
+        answer_data (dict[]): the predictions in the order they were written, each with "pred" and usually "index"
+    """
+    path = os.path.join(answer_res_path, test_type, f"{test_type}_{year}_{section.lower()}_pred.json")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+
+    if os.path.exists(path + "l"):
+        return [_slim(record) for record in iter_jsonl(path + "l") if record.get("sample", 0) == sample]
+
+    if routes is None:
+        routes = route_predictions(answer_res_path, sample)
+    if routes is not None:
+        return routes.get((test_type, str(year), section.lower()), [])
+
+    raise FileNotFoundError(f"No predictions of {test_type} {year} {section} in {answer_res_path}")
+
+
+def join_predictions(questions, answer_data):
+    """align the predictions of a section to its questions by the index of the question
+    the predictions can be reordered, filtered (e.g. to the text_only questions) or concatenated from several shards.
+    if none of them has an index (or the indexes of the questions are not unique), they are aligned by position as in the original json arrays.
+    Args:
+        questions (dict[]): the questions of the section, from GroundTruthIndex.get
+        answer_data (dict[]): the predictions of the section, from load_predictions
+    Returns:
+        preds (str[]): the raw prediction of each question, "" if there is none
+        counts (dict): missing (questions without a prediction), extra (predictions of no question) and duplicate (repeated indexes, the first is used)
+    """
+    counts = {"missing": 0, "extra": 0, "duplicate": 0}
+    question_keys = [str(problem["index"]) for problem in questions]
+    has_index = any(record.get("index") is not None for record in answer_data)
+    if not has_index or len(set(question_keys)) != len(question_keys):
+        preds = [record["pred"] for record in answer_data[:len(questions)]]
+        counts["missing"] = len(questions) - len(preds)
+        counts["extra"] = len(answer_data) - len(preds)
+        return preds + [""] * counts["missing"], counts
+
+    by_index = {}
+    for record in answer_data:
+        key = str(record.get("index"))
+        if key in by_index:
+            counts["duplicate"] += 1
+        else:
+            by_index[key] = record["pred"]
+
+    preds = []
+    for key in question_keys:
+        pred = by_index.get(key)
+        if pred is None:
+            counts["missing"] += 1
+            pred = ""
+        preds.append(pred)
+    counts["extra"] = len(by_index.keys() - set(question_keys))
+    return preds, counts
+
+
+JOIN_REPORT = "join_report.json"
+
+
+def update_join_report(save_path, entries, scored_units):
+    """save the sections whose predictions did not match the questions to save_path/join_report.json
+    Args:
+        save_path (str): the path to save the scoring result of the model
+        entries (dict[]): test_type, year, section, missing, extra and duplicate of each mismatched section
+        scored_units (set): the (test_type, year) scored in this run, whose previous entries are replaced
+    Returns:
+        totals (dict): the missing, extra and duplicate predictions over the whole report
+    """
+    path = os.path.join(save_path, JOIN_REPORT)
+    report = []
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            report = [entry for entry in json.load(f) if (entry["test_type"], entry["year"]) not in scored_units]
+    report = sorted(report + entries, key=lambda entry: (entry["test_type"], entry["year"], entry["section"]))
+
+    if report:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+    elif os.path.exists(path):
+        os.remove(path)
+    return {key: sum(entry[key] for entry in report) for key in ["missing", "extra", "duplicate"]}
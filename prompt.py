@@ -74,3 +74,11 @@ LETTER_EXPLAIN_PROMPT = """
     3. 選択肢のアルファベット番号だけで答えてください。選択肢の内容は不要です。
     4. 選択肢の間と前後に何も入れないでください。
 """
+
+PACKED_EXPLAIN_PROMPT = """
+複数の問題がJSONのリストで与えられた場合：
+
+    1. 各問題の回答を、問題と同じ順に文字列のJSONリストで答えてください。例: ["AC", "3", "B"]
+    2. リストの要素の数は問題の数と同じにしてください。
+    3. リストの前後に何も入れないでください。
+"""
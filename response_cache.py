@@ -0,0 +1,111 @@
+"""
+cache the replies of the endpoint on disk by the hash of the request, so that re-running a model only sends the requests that changed
+"""
+
+import os
+import json
+import hashlib
+from utils import atomic_write
+
+CACHE_SUFFIX = ".json"
+
+
+def _without_images(message):
+    if isinstance(message["content"], str):
+        return message
+    return {**message, "content": [part for part in message["content"] if part.get("type") != "image_url"]}
+
+
+def request_key(payload, image_digests=()):
+    """the sha256 of everything that determines a reply: the model, the rendered messages, the sampling parameters and the images
+    Args:
+        payload (dict): the body of the chat completion request
+        image_digests (str[]): the digests of the images of the question, hashed instead of the images in the messages
+    """
+    payload = {**payload, "messages": [_without_images(message) for message in payload["messages"]]}
+    digest = hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode())
+    for image_digest in image_digests:
+        digest.update(f"|{image_digest}".encode())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        """a content-addressed cache of replies, one small json per request, evicted least recently used first beyond max_bytes
+        Args:
+            cache_dir (str): the path to keep the replies, shared by all the models and runs
+            max_bytes (int): the size the cache is trimmed to
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # key -> [size, last use], the last use of an entry is the mtime of its file, which is touched on every hit
+        self.entries = {}
+        for prefix in os.listdir(cache_dir):
+            prefix_dir = os.path.join(cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if name.endswith(CACHE_SUFFIX):
+                    stat = os.stat(os.path.join(prefix_dir, name))
+                    self.entries[name[:-len(CACHE_SUFFIX)]] = [stat.st_size, stat.st_mtime]
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_SUFFIX)
+
+    def contains(self, key):
+        """whether a reply is cached for the request, without counting a hit or a miss"""
+        return key in self.entries
+
+    def get(self, key):
+        """the cached reply of a request, None if it was never cached or was evicted"""
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            with open(self.path(key), "r") as f:
+                content = json.load(f)["content"]
+            os.utime(self.path(key))
+        except (OSError, ValueError, KeyError):
+            # removed by another run or broken, asked again
+            self._forget(key)
+            self.misses += 1
+            return None
+        self.entries[key][1] = os.stat(self.path(key)).st_mtime
+        self.hits += 1
+        return content
+
+    def put(self, key, content, model=None):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        # write to a temporary file first so that concurrent runs never read a partial reply
+        with atomic_write(self.path(key)) as f:
+            json.dump({"model": model, "content": content}, f, ensure_ascii=False)
+
+        stat = os.stat(self.path(key))
+        if key in self.entries:
+            self.total_bytes -= self.entries[key][0]
+        self.entries[key] = [stat.st_size, stat.st_mtime]
+        self.total_bytes += stat.st_size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """remove the least recently used replies until the cache is at most 90% of max_bytes, so that eviction does not run on every put"""
+        for key, _ in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            self._forget(key)
+
+    def _forget(self, key):
+        size, _ = self.entries.pop(key, (0, 0))
+        self.total_bytes -= size
@@ -0,0 +1,172 @@
+"""
+a SQLite database of the scoring results of every model, filled by calculate_scores.py --results_db, for leaderboards and per-question queries
+without reading the *_history.json files again
+
+    python results_db.py --db ./scoring/results.sqlite leaderboard --input_type text
+    python results_db.py --db ./scoring/results.sqlite missed --exam 医師 --year 2024
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+
+RESULTS_DB_NAME = "results.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS totals (
+    company TEXT NOT NULL,
+    model TEXT NOT NULL,
+    input_type TEXT NOT NULL,
+    exam TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    total_score INTEGER,
+    must_score INTEGER,
+    pass_or_not INTEGER,
+    failed_by_forbidden INTEGER,
+    row TEXT NOT NULL, -- the row of total_scores.csv, with the subject scores of 薬剤
+    PRIMARY KEY (company, model, input_type, exam, year)
+);
+CREATE TABLE IF NOT EXISTS outcomes (
+    company TEXT NOT NULL,
+    model TEXT NOT NULL,
+    input_type TEXT NOT NULL,
+    exam TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    section TEXT NOT NULL, -- lowercase as in the file names, e.g. a or b1
+    position INTEGER NOT NULL,
+    question_index TEXT NOT NULL,
+    pred TEXT,
+    answer TEXT,
+    points INTEGER,
+    valid INTEGER NOT NULL, -- 0 for the questions excluded from the scoring
+    correct INTEGER NOT NULL,
+    forbidden INTEGER NOT NULL, -- whether a forbidden choice was selected
+    PRIMARY KEY (company, model, input_type, exam, year, section, position)
+);
+CREATE INDEX IF NOT EXISTS outcomes_by_question ON outcomes (exam, year, section, question_index);
+CREATE INDEX IF NOT EXISTS outcomes_by_model ON outcomes (model);
+CREATE INDEX IF NOT EXISTS totals_by_model ON totals (model);
+"""
+SCHEMA_VERSION = 1 # 1: the sections are stored lowercase
+
+
+class ResultsDatabase:
+    def __init__(self, path):
+        """open or create the database
+        Args:
+            path (str): the path to the SQLite file, usually scoring/results.sqlite
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL") # the queries can read while scoring writes
+        self.connection.executescript(SCHEMA)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # the databases written before stored the sections as spelled in EXAM_RULES
+            self.connection.execute("UPDATE outcomes SET section = lower(section) WHERE section != lower(section)")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.connection.commit()
+
+    def has_unit(self, company, model, input_type, exam, year):
+        row = self.connection.execute("SELECT 1 FROM totals WHERE company = ? AND model = ? AND input_type = ? AND exam = ? AND year = ?",
+                                      (company, model, input_type, exam, int(year))).fetchone()
+        return row is not None
+
+    def replace_unit(self, company, model, input_type, exam, year, row, outcomes):
+        """replace the results of one (company, model, input_type, exam, year) unit, committed by close()
+        Args:
+            row (dict): the row of total_scores.csv, see calculate_scores.build_test_result
+            outcomes (dict[]): {"section", "position", "index", "pred", "answer", "points", "valid", "correct", "forbidden"} of each question
+        """
+        key = (company, model, input_type, exam, int(year))
+        self.connection.execute("DELETE FROM outcomes WHERE company = ? AND model = ? AND input_type = ? AND exam = ? AND year = ?", key)
+        self.connection.execute("INSERT OR REPLACE INTO totals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", key + (
+            row["total_score"], row["must_score"], bool(row["pass_or_not"]), bool(row["failed_by_forbidden"]), json.dumps(row, ensure_ascii=False, default=str),
+        ))
+        self.connection.executemany("INSERT INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [key + (
+            outcome["section"].lower(), outcome["position"], str(outcome["index"]), outcome["pred"], outcome["answer"], outcome["points"],
+            bool(outcome["valid"]), bool(outcome["correct"]), bool(outcome["forbidden"]),
+        ) for outcome in outcomes])
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def leaderboard(self, exam=None, input_type=None):
+        """the number of passed exams and the total score of each model, best first
+        Returns:
+            rows (tuple[]): (company, model, input_type, passed, exams, total_score)
+        """
+        where, params = _filters(exam=exam, input_type=input_type)
+        return self.connection.execute(f"""
+            SELECT company, model, input_type, SUM(pass_or_not), COUNT(*), SUM(total_score) FROM totals {where}
+            GROUP BY company, model, input_type ORDER BY SUM(pass_or_not) DESC, SUM(total_score) DESC
+        """, params).fetchall()
+
+    def missed_by_all(self, exam, year=None, input_type=None):
+        """the questions that no model answered correctly, without the questions excluded from the scoring
+        Returns:
+            rows (tuple[]): (exam, year, section, index, answer, the number of models)
+        """
+        where, params = _filters(exam=exam, year=year, input_type=input_type, valid=True)
+        return self.connection.execute(f"""
+            SELECT exam, year, section, question_index, MAX(answer), COUNT(*) FROM outcomes {where}
+            GROUP BY exam, year, section, question_index HAVING MAX(correct) = 0 ORDER BY year, section, MIN(position)
+        """, params).fetchall()
+
+    def question(self, exam, year, section, index):
+        """the prediction of every model on one question, the section in any case
+        Returns:
+            rows (tuple[]): (company, model, input_type, pred, correct)
+        """
+        return self.connection.execute("""
+            SELECT company, model, input_type, pred, correct FROM outcomes WHERE exam = ? AND year = ? AND section = ? AND question_index = ?
+            ORDER BY company, model, input_type
+        """, (exam, int(year), section.lower(), str(index))).fetchall()
+
+
+def _filters(**filters):
+    """the WHERE clause of the filters that are not None"""
+    filters = {name: value for name, value in filters.items() if value is not None}
+    if not filters:
+        return "", ()
+    return "WHERE " + " AND ".join(f"{name} = ?" for name in filters), tuple(filters.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="query the results database written by calculate_scores.py --results_db")
+    parser.add_argument("--db", type=str, default=os.path.join("./scoring", RESULTS_DB_NAME))
+    subparsers = parser.add_subparsers(dest="query", required=True)
+    leaderboard_parser = subparsers.add_parser("leaderboard", help="the number of passed exams of each model")
+    leaderboard_parser.add_argument("--exam", type=str, default=None)
+    leaderboard_parser.add_argument("--input_type", type=str, default=None)
+    missed_parser = subparsers.add_parser("missed", help="the questions that no model answered correctly")
+    missed_parser.add_argument("--exam", type=str, required=True)
+    missed_parser.add_argument("--year", type=int, default=None)
+    missed_parser.add_argument("--input_type", type=str, default=None)
+    question_parser = subparsers.add_parser("question", help="the prediction of every model on one question")
+    question_parser.add_argument("--exam", type=str, required=True)
+    question_parser.add_argument("--year", type=int, required=True)
+    question_parser.add_argument("--section", type=str, required=True)
+    question_parser.add_argument("--index", type=str, required=True)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise FileNotFoundError(f"No results database at {args.db}, run calculate_scores.py --results_db {args.db}")
+    db = ResultsDatabase(args.db)
+    if args.query == "leaderboard":
+        for company, model, input_type, passed, exams, total_score in db.leaderboard(args.exam, args.input_type):
+            print(f"{company}\t{model}\t{input_type}\t{passed}/{exams} passed\t{total_score}")
+    elif args.query == "missed":
+        rows = db.missed_by_all(args.exam, args.year, args.input_type)
+        for exam, year, section, index, answer, n_models in rows:
+            print(f"{exam}\t{year}\t{section}\t{index}\tanswer {answer}\tmissed by {n_models} models")
+        print(f"{len(rows)} questions missed by every model")
+    else:
+        for company, model, input_type, pred, correct in db.question(args.exam, args.year, args.section, args.index):
+            print(f"{company}\t{model}\t{input_type}\t{pred}\t{'correct' if correct else 'wrong'}")
+    db.close()
@@ -0,0 +1,92 @@
+"""
+order the requests of an inference run so that a self-hosted server can reuse its prefix (KV) cache:
+the requests sharing a rendered system message are sent together, and by length within them so that the batches are uniform
+"""
+
+import asyncio
+import hashlib
+
+
+def text_length(content):
+    """the characters of the text of a message, without the images of a multimodal message"""
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(part.get("text", "")) for part in content)
+
+
+class ScheduledRequest:
+    def __init__(self, messages, tag=None, image_digests=(), build_messages=None):
+        """one chat completion request
+        Args:
+            messages (dict[]): the chat messages, the first one is the system message shared by the questions of an exam
+            tag: anything identifying the request for the caller, e.g. (exam, year, section, position)
+            image_digests (str[]): see InferenceClient.complete
+            build_messages (callable): if given, called (in a thread) right before the request is sent for the messages with the images attached,
+                so that the images are only loaded while their request is in flight
+        """
+        self.messages = messages
+        self.tag = tag
+        self.image_digests = image_digests
+        self.build_messages = build_messages
+        self.prefix = hashlib.sha256(messages[0]["content"].encode()).hexdigest()[:16]
+        # the characters of the rest of the prompt, close enough to the number of tokens for Japanese text to sort by
+        self.length = sum(text_length(message["content"]) for message in messages[1:])
+
+
+class PrefixScheduler:
+    def __init__(self, max_concurrency=8, batch_size=None, prefix_aware=True):
+        """send the requests grouped by system prefix and sorted by length within each group
+        Args:
+            max_concurrency (int): the number of requests in flight, as the client allows
+            batch_size (int): if given, the requests are sent in batches of this size (never spanning two prefixes) and a batch starts when the previous one finished.
+                None keeps max_concurrency requests in flight at all times, which suits servers with continuous batching
+            prefix_aware (bool): if False, the requests are sent in the order they were given, for comparison
+        """
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.prefix_aware = prefix_aware
+        self.dispatched = [] # the requests in the order they were sent
+
+    def order(self, requests):
+        """the requests grouped by prefix in the order the prefixes first appear, shortest first within each group"""
+        if not self.prefix_aware:
+            return [list(requests)]
+        groups = {}
+        for request in requests:
+            groups.setdefault(request.prefix, []).append(request)
+        return [sorted(group, key=lambda request: request.length) for group in groups.values()]
+
+    async def run(self, client, requests, on_done):
+        """send the requests and call on_done(request, content, error) as each one finishes, error is None on success"""
+        groups = self.order(requests)
+
+        async def send(request):
+            self.dispatched.append(request)
+            try:
+                messages = request.messages
+                if request.build_messages is not None:
+                    messages = await asyncio.get_running_loop().run_in_executor(None, request.build_messages)
+                content = await client.complete(messages, request.image_digests)
+            except Exception as e:
+                on_done(request, None, e)
+            else:
+                on_done(request, content, None)
+
+        if self.batch_size:
+            for group in groups:
+                for start in range(0, len(group), self.batch_size):
+                    await asyncio.gather(*(send(request) for request in group[start:start + self.batch_size]))
+            return
+
+        queue = [request for group in groups for request in group]
+        queue.reverse() # popped from the end
+
+        async def worker():
+            while queue:
+                await send(queue.pop())
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(queue)))))
+
+    def prefix_switches(self):
+        """the number of times consecutive dispatched requests had different prefixes"""
+        return sum(a.prefix != b.prefix for a, b in zip(self.dispatched, self.dispatched[1:]))
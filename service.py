@@ -0,0 +1,237 @@
+"""
+a local HTTP service scoring predictions sent as JSON, with the ground truth of every exam loaded once, for dashboards and training loops
+that score checkpoints on the fly without writing to results/
+
+    python service.py --port 8100
+    curl -s localhost:8100/score -d '{"test_type": "医師", "year": 2024, "predictions": {"A": [{"index": "1", "pred": "a"}]}}'
+
+POST /score takes one request or {"batch": [request, ...]}, each {"test_type", "year", "predictions": {section: [{"index", "pred"}, ...]}} with optional
+"fix_format" and "history". the sections that are not sent count as unanswered. GET /metrics returns the latency statistics, GET /health the loaded exams
+"""
+
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils import TEST_TYPE_MAP
+from exam_rules import EXAM_RULES, YEARS, get_plan
+from calculate_scores import Scoring, build_test_result
+
+
+class LatencyStats:
+    def __init__(self, window=10000):
+        """the latency of the last window requests, shared by the threads of the server"""
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_scored = 0 # the (exam, year) scored, more than n_requests with batches
+
+    def add(self, seconds, n_scored=0, error=False):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.n_requests += 1
+            self.n_scored += n_scored
+            self.n_errors += error
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            summary = {"requests": self.n_requests, "errors": self.n_errors, "scored": self.n_scored}
+        if latencies:
+            summary.update({
+                "latency_ms": {
+                    "mean": 1000 * sum(latencies) / len(latencies),
+                    **{f"p{q}": 1000 * latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))] for q in (50, 95, 99)},
+                    "max": 1000 * latencies[-1],
+                },
+                "window": len(latencies),
+            })
+        return summary
+
+
+class ScoringService:
+    def __init__(self, data_dir, cache_dir=None, exam_store=None):
+        """score predictions sent in memory against the ground truth of data_dir, which is loaded once for all the threads
+        Args:
+            data_dir (str): the path to the ground truth data
+            cache_dir (str): the path to cache the parsed ground truth across runs
+            exam_store (str): the path to the exam store to read the ground truth from instead of the json files, see exam_store.py
+        """
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.exam_store = exam_store
+        # one Scoring per thread for its own counters, all of them share the ground truth index of this process
+        self.local = threading.local()
+        self.stats = LatencyStats()
+        self.loaded = []
+        scoring = self.scoring()
+        for test_type in TEST_TYPE_MAP:
+            for year in YEARS:
+                try:
+                    # every plan is built here, so that the threads only read the ground truth and the plans
+                    get_plan(test_type, year, scoring.ground_truth)
+                except FileNotFoundError:
+                    continue
+                self.loaded.append((test_type, year))
+
+    def scoring(self):
+        if not hasattr(self.local, "scoring"):
+            self.local.scoring = Scoring(None, None, self.data_dir, self.cache_dir, exam_store=self.exam_store, collect_outcomes=True)
+        return self.local.scoring
+
+    def score(self, request):
+        """score the predictions of one exam and year
+        Args:
+            request (dict): {"test_type", "year", "predictions": {section: [{"index", "pred"}, ...]}, "fix_format": bool, "history": bool}
+        Returns:
+            result (dict): the row of total_scores.csv with the sub scores, the forbidden choices selected, the correct answers of each section,
+                the sections whose predictions did not match the questions, and the history of each section if asked
+        Raises:
+            ValueError: if the request is malformed or the exam, year or predictions are invalid
+        """
+        if not isinstance(request, dict):
+            raise ValueError(f"A request should be an object, not {type(request).__name__}")
+        test_type = request.get("test_type", request.get("exam"))
+        year = request.get("year")
+        if test_type not in EXAM_RULES:
+            raise ValueError(f"Invalid test type: {test_type}")
+        if not isinstance(year, int) or isinstance(year, bool) or year not in YEARS:
+            raise ValueError(f"Invalid year: {year!r}, expected an integer in {YEARS.start}-{YEARS.stop - 1}")
+        if (test_type, year) not in self.loaded:
+            raise ValueError(f"No ground truth for {test_type} {year}")
+        for option in ("fix_format", "history"):
+            if not isinstance(request.get(option, False), bool):
+                raise ValueError(f"{option} should be true or false")
+        predictions = request.get("predictions")
+        if not isinstance(predictions, dict):
+            raise ValueError("predictions should be {section: [{\"index\": ..., \"pred\": ...}, ...]}")
+        sections = {section.lower(): section for section in EXAM_RULES[test_type]["sections"]}
+        unknown = [section for section in predictions if section.lower() not in sections]
+        if unknown:
+            raise ValueError(f"Invalid sections of {test_type}: {unknown}, expected {list(sections.values())}")
+        answer_data = {}
+        for section, preds in predictions.items():
+            if not isinstance(preds, list) or not all(isinstance(record, dict) and _is_key(record.get("pred")) and
+                                                      (record.get("index") is None or _is_key(record["index"])) for record in preds):
+                raise ValueError(f"The predictions of {section} should be [{{\"index\": ..., \"pred\": ...}}, ...] with strings or integers")
+            answer_data[sections[section.lower()]] = [{"index": record.get("index"), "pred": str(record["pred"])} for record in preds]
+
+        scoring = self.scoring()
+        try:
+            total_score, pass_or_not, failed_by_forbidden, history = scoring.score_predictions(test_type, year, answer_data, request.get("fix_format", False))
+            outcomes, join_report = scoring.outcomes, scoring.join_report
+        finally:
+            scoring.outcomes, scoring.join_report, scoring.n_repaired = [], [], 0
+
+        result = build_test_result(test_type, year, total_score, pass_or_not, failed_by_forbidden)
+        if isinstance(total_score, list):
+            result["sub_scores"] = total_score
+        elif isinstance(total_score, dict): # 薬剤, the must section and the rest
+            result["sub_scores"] = [total_score["must_score"], total_score["total_score"] - total_score["must_score"]]
+        else:
+            result["sub_scores"] = [total_score]
+        result["forbidden"] = sum(outcome["forbidden"] for outcome in outcomes)
+        result["sections"] = {}
+        for outcome in outcomes:
+            counts = result["sections"].setdefault(outcome["section"], {"correct": 0, "questions": 0})
+            counts["correct"] += outcome["correct"]
+            counts["questions"] += 1
+        result["join_report"] = join_report
+        if request.get("history"):
+            result["history"] = history
+        return result
+
+
+def _is_key(value):
+    """whether an index or a prediction is a string or an integer"""
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    service = None # the ScoringService, set by serve
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.reply(200, self.service.stats.summary())
+        elif self.path == "/health":
+            self.reply(200, {"status": "ok", "loaded": [f"{test_type} {year}" for test_type, year in self.service.loaded]})
+        else:
+            self.reply(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError(f"The body should be an object, not {type(body).__name__}")
+            if "batch" in body:
+                if not isinstance(body["batch"], list):
+                    raise ValueError("batch should be a list of requests")
+                reply = {"results": [self.service.score(request) for request in body["batch"]]}
+            else:
+                reply = self.service.score(body)
+        except ValueError as e:
+            latency = time.perf_counter() - start
+            self.service.stats.add(latency, error=True)
+            self.reply(400, {"error": f"{type(e).__name__}: {e}", "latency_ms": 1000 * latency})
+            return
+        except Exception as e:
+            # a bug of the scoring rather than of the request, answered and counted so that the client does not see a dropped connection
+            latency = time.perf_counter() - start
+            self.service.stats.add(latency, error=True)
+            self.reply(500, {"error": f"{type(e).__name__}: {e}", "latency_ms": 1000 * latency})
+            return
+        latency = time.perf_counter() - start
+        self.service.stats.add(latency, len(reply["results"]) if "results" in reply else 1)
+        reply["latency_ms"] = 1000 * latency
+        self.reply(200, reply)
+
+    def reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # no log per request, see /metrics
+
+
+def serve(data_dir, host="127.0.0.1", port=0, cache_dir=None, exam_store=None):
+    """load the ground truth and start the service in a background thread
+    Returns:
+        server (ThreadingHTTPServer): the running server at f"http://{host}:{server.server_port}", call server.shutdown() to stop it.
+            server.RequestHandlerClass.service is the ScoringService
+    """
+    handler = type("Handler", (ScoringHandler,), {"service": ScoringService(data_dir, cache_dir, exam_store)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="a local HTTP service scoring predictions sent as JSON")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--data_dir", type=str, default="./exams/JA")
+    parser.add_argument("--exam_store", type=str, default=None, help="read the ground truth from the SQLite file built by exam_store.py")
+    parser.add_argument("--cache_dir", type=str, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    server = serve(args.data_dir, args.host, args.port, args.cache_dir, args.exam_store)
+    print(f"Loaded {len(server.RequestHandlerClass.service.loaded)} exams in {time.perf_counter() - start:.1f}s, serving on http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
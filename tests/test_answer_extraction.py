@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_extraction import extract_answer
+from utils import normalize_answer
+
+
+@pytest.mark.parametrize("pred, style, expected", [
+    # short outputs with words are extracted, not kept as they are
+    ("Answer C", "letter", "C"),
+    ("It is C", "letter", "C"),
+    ("I think B", "letter", "B"),
+    # outputs that are only choices are kept
+    ("AC", "letter", "AC"),
+    ("a, c", "letter", "a, c"),
+    ("1, 3", "number", "1, 3"),
+    ("2と4", "number", "2と4"),
+    # the explanation after the answer is not part of it
+    ("答え: 3. 理由：1は誤り", "number", "3"),
+    ("Answer: B. A is wrong", "letter", "B"),
+    ("正解は3と5です", "number", "35"),
+    ("答え：ＡＣ", "letter", "AC"),
+    ('{"answer": "AC"}', "letter", "AC"),
+])
+def test_extract_answer(pred, style, expected):
+    assert extract_answer(pred, style) == expected
+
+
+@pytest.mark.parametrize("pred, answer", [("Answer C", "C"), ("It is C", "C"), ("I think B", "B"), ("a, c", "AC")])
+def test_extracted_answer_normalizes_to_the_choices(pred, answer):
+    assert normalize_answer(extract_answer(pred, "letter")) == answer
@@ -1,3 +1,11 @@
+import os
+import re
+import hashlib
+import tempfile
+import unicodedata
+from functools import lru_cache
+from contextlib import contextmanager
+
 # map role to detailed role name
 ROLE_MAP = {
     '医師': '医師',
@@ -24,4 +32,101 @@ TEST_TYPE_MAP = {
     '薬剤': '薬剤師国家試験',
     '視能': '視能訓練士国家試験',
     '診療': '診療放射線技師国家試験'
-}
\ No newline at end of file
+}
+
+NON_ALNUM_PATTERN = re.compile(r'[^A-Z0-9]')
+
+# Japanese choice markers (ア, イ, ...) standing alone, not inside a katakana word. folded to the letter of the same position
+CHOICE_MARKER_PATTERN = re.compile(r'(?<![ァ-ヺー])[アイウエオカキクケコ](?![ァ-ヺー])')
+CHOICE_MARKERS = dict(zip("アイウエオカキクケコ", "ABCDEFGHIJ"))
+
+# the answers longer than this are not kept in the cache, they are mostly free text that does not repeat
+NORMALIZE_CACHE_SIZE = 1 << 16
+NORMALIZE_CACHE_MAX_LENGTH = 64
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_answer(answer):
+    # NFKC folds full-width and circled characters (Ａ, １, ①) and half-width katakana to their plain forms
+    answer = unicodedata.normalize("NFKC", answer)
+    answer = CHOICE_MARKER_PATTERN.sub(lambda match: CHOICE_MARKERS[match.group()], answer).upper()
+    # Remove non-alphabetic non-numeric characters and sort the characters. the length of the answer is limited to <6
+    return ''.join(sorted(NON_ALNUM_PATTERN.sub('', answer)))[:6]
+
+
+def normalize_answer(answer):
+    """normalize an answer for comparison, memoized for the whole process"""
+    if len(answer) > NORMALIZE_CACHE_MAX_LENGTH:
+        return _normalize_answer.__wrapped__(answer)
+    return _normalize_answer(answer)
+
+
+def normalization_stats():
+    """the hits and misses of the cache of normalize_answer in this process"""
+    info = _normalize_answer.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+
+# the characters a normalized answer can contain, in the order sorted() puts them
+CHOICE_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+CHOICE_BITS = {choice: 1 << i for i, choice in enumerate(CHOICE_ALPHABET)}
+
+
+def choice_mask(answer):
+    """the set of choices in an answer as a bitmask over CHOICE_ALPHABET, other characters are ignored"""
+    mask = 0
+    for choice in answer:
+        mask |= CHOICE_BITS.get(choice, 0)
+    return mask
+
+
+def encode_answer(answer):
+    """encode a normalized answer as an int, two answers are equal if and only if their codes are equal
+    a set of distinct choices (e.g. "AC", "13") is encoded as its bitmask (>= 0). since the normalized answer is sorted, the set decides the string.
+    numeric answers with a repeated digit (e.g. "11", "100") are encoded as a negative number in base 37, which fits in int64 for the 6 characters of a normalized answer
+    """
+    mask = choice_mask(answer)
+    if bin(mask).count("1") == len(answer):
+        return mask
+    code = 0
+    for choice in answer:
+        code = code * 37 + CHOICE_ALPHABET.index(choice) + 1
+    return -1 - code
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """open a temporary file next to path, moved over path once the with block is done and removed if it raises,
+    so that readers and concurrent runs never see a partial file. f.name is the temporary path, e.g. for sqlite3.connect"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    os.close(fd)
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@lru_cache(maxsize=None)
+def _cached_sha256(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path):
+    """the sha256 of a file, remembered per process for as long as its mtime and size do not change"""
+    stat = os.stat(path)
+    return _cached_sha256(path, stat.st_mtime_ns, stat.st_size)
+
+
+def to_float(value):
+    """float(value), None if it is missing or not a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
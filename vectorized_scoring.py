@@ -0,0 +1,158 @@
+"""
+score many LLMs at once with NumPy, one row per question and one column per model
+"""
+
+import numpy as np
+from ground_truth import get_ground_truth_index
+from exam_rules import get_plan
+from predictions import load_predictions, join_predictions, route_predictions
+from utils import normalize_answer, encode_answer, choice_mask
+from answer_extraction import answer_style, extract_answers
+
+
+def judge_arrays(plan, sub_scores, forbidden, area_score=None, area_total=None):
+    """the array version of ScoringPlan.judge, for any number of models (and resamples) along the trailing axes
+    Args:
+        plan (ScoringPlan): the plan of the exam and year
+        sub_scores (np.ndarray): the points earned in each sub score, shape (groups, ...)
+        forbidden (np.ndarray): the number of forbidden choices selected, shape (...)
+        area_score (np.ndarray): the points earned in each subject outside the must section, shape (areas, ...)
+        area_total (np.ndarray): the points earned in each subject, shape (areas, ...)
+    Returns:
+        pass_or_not (np.ndarray): bool, shape (...)
+        failed_by_forbidden (np.ndarray): bool, shape (...)
+    """
+    if plan.forbidden_limit is not None:
+        failed_by_forbidden = forbidden > plan.forbidden_limit
+    else:
+        failed_by_forbidden = np.zeros(np.shape(forbidden), dtype=bool)
+
+    if plan.has_areas:
+        pass_or_not = (sub_scores.sum(axis=0) >= plan.pass_lines) & (sub_scores[0] >= plan.rule["must_line"]) & \
+            (area_score >= plan.rule["area_ratio"] * area_total).all(axis=0)
+    elif isinstance(plan.pass_lines, list):
+        lines = np.array(plan.pass_lines).reshape((-1,) + (1,) * (sub_scores.ndim - 1))
+        pass_or_not = (sub_scores >= lines).all(axis=0) & ~failed_by_forbidden
+    else:
+        pass_or_not = (sub_scores.sum(axis=0) >= plan.pass_lines) & ~failed_by_forbidden
+    return pass_or_not, failed_by_forbidden
+
+
+class VectorizedScoring:
+    def __init__(self, data_dir, cache_dir=None, exam_store=None, sample=0):
+        """score the results of many LLMs on an exam in a few array operations
+        Args:
+            data_dir (str): the path to the ground truth data
+            cache_dir (str): the path to cache the parsed ground truth across runs
+            exam_store (str): the path to the exam store to read the ground truth from instead of the json files, see exam_store.py
+            sample (int): the sample to score when the JSONL predictions have several samples per question
+        """
+        self.ground_truth = get_ground_truth_index(data_dir, cache_dir, exam_store)
+        self.sample = sample
+        # answer_res_path -> its predictions.jsonl split by section, kept for the whole sweep since the exams are read one at a time for all the models
+        self.routes = {}
+        self.arrays = {} # (exam, year) -> the ground truth as arrays
+
+    def plan(self, exam, year):
+        return get_plan(exam, year, self.ground_truth)
+
+    def gold_arrays(self, exam, year):
+        """the scoring plan of an exam as arrays with one entry per question"""
+        key = (exam, str(year))
+        if key in self.arrays:
+            return self.arrays[key]
+
+        plan = self.plan(exam, year)
+        questions = [problem for _, section_questions in plan.sections for problem in section_questions]
+        self.arrays[key] = {
+            "answer_code": np.array([problem["answer_code"] for problem in questions], dtype=np.int64),
+            "points": np.array([problem["points"] for problem in questions], dtype=np.int64),
+            "kinki_mask": np.array([problem["kinki_mask"] for problem in questions], dtype=np.int64),
+            "valid": np.array(plan.valid, dtype=bool),
+            "groups": np.array(plan.groups, dtype=np.int64),
+            "area_ids": np.array(plan.area_ids, dtype=np.int64),
+            # the questions outside the must section, whose points count for area_score
+            "not_must": np.array([group != 0 for group in plan.groups], dtype=bool),
+        }
+        return self.arrays[key]
+
+    def load_predictions(self, answer_res_paths, exam, year, fix_format=False):
+        """the normalized predictions of every model as an object array of shape (questions, models), extracted from verbose outputs with fix_format"""
+        plan = self.plan(exam, year)
+        columns = []
+        for answer_res_path in answer_res_paths:
+            if answer_res_path not in self.routes:
+                self.routes[answer_res_path] = route_predictions(answer_res_path, self.sample)
+            column = []
+            for section, questions in plan.sections:
+                preds, _ = join_predictions(questions, load_predictions(answer_res_path, exam, year, section, self.sample, self.routes[answer_res_path]))
+                if fix_format:
+                    preds, _ = extract_answers(preds, [answer_style(problem["answer"]) for problem in questions])
+                column.extend(normalize_answer(pred) for pred in preds)
+            columns.append(column)
+        return np.array(columns, dtype=object).T.reshape(-1, len(answer_res_paths))
+
+    def evaluate(self, exam, year, preds):
+        """score a (questions, models) array of normalized predictions
+        Returns:
+            result (dict): correct and forbidden_choices (questions, models), sub_scores (groups, models), forbidden (models,), pass_or_not (models,),
+                failed_by_forbidden (models,) and for 薬剤 area_score and area_total (areas, models)
+        """
+        plan = self.plan(exam, year)
+        gold = self.gold_arrays(exam, year)
+        n_models = preds.shape[1]
+
+        # the answers are compared and checked against the forbidden choices as integers, see utils.encode_answer
+        pred_codes = np.frompyfunc(encode_answer, 1, 1)(preds).astype(np.int64)
+        pred_masks = np.frompyfunc(choice_mask, 1, 1)(preds).astype(np.int64)
+
+        correct = (pred_codes == gold["answer_code"][:, None]) & gold["valid"][:, None]
+        earned = correct * gold["points"][:, None]
+        sub_scores = np.zeros((plan.n_groups, n_models), dtype=np.int64)
+        np.add.at(sub_scores, gold["groups"], earned)
+        forbidden_choices = (pred_masks & gold["kinki_mask"][:, None]) != 0
+        forbidden = forbidden_choices.sum(axis=0)
+        result = {"correct": correct, "sub_scores": sub_scores, "forbidden_choices": forbidden_choices, "forbidden": forbidden}
+
+        if plan.has_areas:
+            scored = gold["area_ids"] >= 0
+            area_total = np.zeros((len(plan.areas), n_models), dtype=np.int64)
+            np.add.at(area_total, gold["area_ids"][scored], earned[scored])
+            not_must = scored & gold["not_must"]
+            area_score = np.zeros((len(plan.areas), n_models), dtype=np.int64)
+            np.add.at(area_score, gold["area_ids"][not_must], earned[not_must])
+            result.update({"area_score": area_score, "area_total": area_total})
+
+        result["pass_or_not"], result["failed_by_forbidden"] = judge_arrays(plan, sub_scores, forbidden, result.get("area_score"), result.get("area_total"))
+        return result
+
+    def score(self, exam, year, answer_res_paths, fix_format=False):
+        """score the results of several LLMs on one exam and year
+        Args:
+            exam (str): the type of the exam, e.g. 医師
+            year (int): the year of the exam
+            answer_res_paths (str[]): the paths to the answers of the LLMs
+            fix_format (bool): if True, extract the answer from verbose outputs before scoring
+        Returns:
+            results (tuple[]): (total_score, pass_or_not, failed_by_forbidden) of each LLM, the same as Scoring.score
+        """
+        plan = self.plan(exam, year)
+        result = self.evaluate(exam, year, self.load_predictions(answer_res_paths, exam, year, fix_format))
+
+        results = []
+        for j in range(len(answer_res_paths)):
+            pass_or_not = bool(result["pass_or_not"][j])
+            failed_by_forbidden = bool(result["failed_by_forbidden"][j])
+            if plan.has_areas:
+                total_score = {
+                    "total_score": int(result["sub_scores"][:, j].sum()),
+                    "must_score": int(result["sub_scores"][0, j]),
+                    "area_score": {area: int(result["area_score"][k, j]) for k, area in enumerate(plan.areas)},
+                    "area_total_score": {area: int(result["area_total"][k, j]) for k, area in enumerate(plan.areas)},
+                }
+            elif isinstance(plan.pass_lines, list):
+                total_score = [int(score) for score in result["sub_scores"][:, j]]
+            else:
+                total_score = int(result["sub_scores"][:, j].sum())
+            results.append((total_score, pass_or_not, failed_by_forbidden))
+        return results
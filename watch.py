@@ -0,0 +1,231 @@
+"""
+score the results as the inference jobs write them: poll results/ and score each (company, model, input_type, exam, year) once the predictions of
+all its sections are there and have not changed for a while, keeping the ground truth in memory between the units
+
+    python watch.py --interval 2 --debounce 5 --results_db ./scoring/results.sqlite
+"""
+
+import os
+import time
+import argparse
+import traceback
+from utils import TEST_TYPE_MAP
+from exam_rules import EXAM_RULES, YEARS, invalidate_plans
+from exam_store import open_store
+from history_writer import HISTORY_FORMATS, HistoryTableWriter
+from predictions import prediction_files, update_join_report, PREDICTIONS_JSONL
+from manifest import unit_digest, load_manifest, save_manifest, read_total_scores
+from results_db import ResultsDatabase
+from calculate_scores import Scoring, select_combos, write_total_scores, output_version, parse_years
+
+
+def file_signature(paths):
+    """(name, mtime_ns, size) of each file, the files that disappeared in between are left out"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def predictions_complete(answer_res_path, test_type, year):
+    """whether the predictions of every section of an exam and year were written, a predictions.jsonl counts for all of them"""
+    if os.path.exists(os.path.join(answer_res_path, PREDICTIONS_JSONL)):
+        return True
+    exam_dir = os.path.join(answer_res_path, test_type)
+    for section in EXAM_RULES[test_type]["sections"]:
+        prefix = os.path.join(exam_dir, f"{test_type}_{year}_{section.lower()}_pred")
+        if not (os.path.exists(prefix + ".json") or os.path.exists(prefix + ".jsonl")):
+            return False
+    return True
+
+
+class ResultsWatcher:
+    def __init__(self, res_dir, score_dir, data_dir, cache_dir=None, exam_store=None, fix_format=False, history_format="json", export_json=False, sample=0,
+                 results_db=None, debounce=5.0, models=None, input_types=None, exams=None, years=None):
+        """score the units of res_dir whose predictions changed, one poll at a time
+        Args:
+            res_dir, score_dir, data_dir, cache_dir, exam_store, fix_format, history_format, export_json, sample, results_db: see calculate_scores.score_all
+            debounce (float): the seconds the prediction files of a unit should be left untouched before it is scored, so that files still being written are not read
+            models, input_types (str[]): the filters of calculate_scores.select_combos, checked again at each poll so that new models are picked up
+            exams (str[]), years (int[]): the exams and years to watch, defaults to all
+        """
+        self.res_dir = res_dir
+        self.score_dir = score_dir
+        self.data_dir = data_dir
+        self.exam_store = exam_store
+        self.fix_format = fix_format
+        self.history_format = history_format
+        self.debounce = debounce
+        self.models = models
+        self.input_types = input_types
+        self.exams = list(TEST_TYPE_MAP) if exams is None else exams
+        self.years = list(YEARS) if years is None else years
+        self.version = output_version(history_format, export_json, sample)
+
+        # one Scoring for the whole run, its ground truth index stays in memory and is only read again for the exams whose files change
+        self.scoring = Scoring(res_dir, score_dir, data_dir, cache_dir, history_format, export_json, sample, exam_store, collect_outcomes=results_db is not None)
+        self.ground_truth = self.scoring.ground_truth
+        self.db = ResultsDatabase(results_db) if results_db is not None else None
+        self.scored = {} # unit -> the signature of its prediction files when it was scored
+        self.failed = {} # unit -> the signature of its prediction files when it failed, tried again once they change
+        self.ground_truth_signatures = self._ground_truth_signatures()
+
+    def _ground_truth_signatures(self):
+        if self.exam_store is not None:
+            return {None: file_signature([self.exam_store])}
+        signatures = {}
+        for test_type in self.exams:
+            for year in self.years:
+                signatures[(test_type, year)] = file_signature([self.ground_truth.path(test_type, year, section) for section in EXAM_RULES[test_type]["sections"]])
+        return signatures
+
+    def _check_ground_truth(self):
+        """read the changed exams again and score them again for every model"""
+        signatures = self._ground_truth_signatures()
+        for key, signature in signatures.items():
+            if self.ground_truth_signatures.get(key) == signature:
+                continue
+            if key is None:
+                # a rebuilt store is a new file, the open connection still reads the old one
+                if self.ground_truth.store is not None:
+                    self.ground_truth.store.close()
+                self.ground_truth.store = open_store(self.exam_store, self.data_dir)
+                self.ground_truth.invalidate()
+                invalidate_plans(self.ground_truth)
+                print(f"{self.exam_store} changed, scoring every unit again")
+                self.scored = {}
+            else:
+                self.ground_truth.invalidate(*key)
+                invalidate_plans(self.ground_truth, *key)
+                print(f"The ground truth of {key[0]} {key[1]} changed, scoring it again")
+                self.scored = {unit: signature for unit, signature in self.scored.items() if unit[3:] != key}
+            self.failed = {}
+        self.ground_truth_signatures = signatures
+
+    def ready_units(self, now=None):
+        """the units whose prediction files are complete, changed since they were scored and untouched for debounce seconds
+        Returns:
+            units (tuple[]): (unit, signature)
+        """
+        now = time.time() if now is None else now
+        units = []
+        for combo in select_combos(self.res_dir, self.models, self.input_types):
+            answer_res_path = os.path.join(self.res_dir, *combo)
+            for test_type in self.exams:
+                for year in self.years:
+                    unit = (*combo, test_type, year)
+                    if not predictions_complete(answer_res_path, test_type, year):
+                        continue
+                    signature = file_signature(prediction_files(answer_res_path, test_type, year))
+                    if not signature or self.scored.get(unit) == signature or self.failed.get(unit) == signature:
+                        continue
+                    if now - max(mtime_ns for _, mtime_ns, _ in signature) / 1e9 < self.debounce:
+                        continue # still being written
+                    units.append((unit, signature))
+        return units
+
+    def poll(self):
+        """score the ready units
+        Returns:
+            scored (tuple[]): the units scored in this poll
+        """
+        self._check_ground_truth()
+        ready = self.ready_units()
+        store = self.ground_truth.store
+        manifests = {}
+        scored = []
+        for unit, signature in ready:
+            company, model, input_type, test_type, year = unit
+            answer_res_path = os.path.join(self.res_dir, company, model, input_type)
+            save_path = os.path.join(self.score_dir, company, model, input_type)
+            if save_path not in manifests:
+                manifests[save_path] = load_manifest(save_path) if os.path.exists(save_path) else {"units": {}}
+            digest = unit_digest(self.data_dir, answer_res_path, test_type, year, self.version, self.fix_format, store)
+            csv_path = os.path.join(save_path, test_type, "total_scores.csv")
+            rows = read_total_scores(csv_path)
+            if unit not in self.scored and manifests[save_path]["units"].get(f"{test_type}/{year}") == digest and year in rows \
+                    and (self.db is None or self.db.has_unit(*unit)):
+                # scored by an earlier run and unchanged since
+                self.scored[unit] = signature
+                continue
+
+            os.makedirs(os.path.join(save_path, test_type), exist_ok=True)
+            try:
+                row = self.scoring.score_year(test_type, year, answer_res_path, save_path, self.fix_format)
+            except Exception:
+                # e.g. a json file cut short by a crashed writer, tried again when the files change
+                print(f"Failed to score {' '.join(str(part) for part in unit)}:\n{traceback.format_exc()}")
+                self.failed[unit] = signature
+                self.scoring.pending_history, self.scoring.join_report, self.scoring.n_repaired = [], [], 0
+                if self.scoring.outcomes is not None:
+                    self.scoring.outcomes = []
+                continue
+
+            rows[year] = row
+            write_total_scores(list(rows.values()), csv_path)
+            if self.scoring.pending_history:
+                writer = HistoryTableWriter(save_path, self.history_format, replaced_units={(test_type, year)})
+                for _, history_test_type, history_data in self.scoring.pending_history:
+                    writer.append(history_test_type, history_data)
+                writer.close()
+                self.scoring.pending_history = []
+            update_join_report(save_path, self.scoring.join_report, {(test_type, year)})
+            self.scoring.join_report = []
+            self.scoring.n_repaired = 0
+            if self.db is not None:
+                self.db.replace_unit(*unit, row, self.scoring.outcomes)
+                self.db.commit()
+                self.scoring.outcomes = []
+            manifests[save_path]["units"][f"{test_type}/{year}"] = digest
+            save_manifest(save_path, manifests[save_path])
+
+            self.scored[unit] = signature
+            self.failed.pop(unit, None)
+            scored.append(unit)
+            print(f"Scored {company} {model} {input_type} {test_type} {year}: total {row['total_score']}, {'passed' if row['pass_or_not'] else 'failed'}")
+        return scored
+
+    def run(self, interval=2.0):
+        """poll every interval seconds until interrupted"""
+        print(f"Watching {self.res_dir}, press Ctrl+C to stop")
+        try:
+            while True:
+                start = time.monotonic()
+                self.poll()
+                time.sleep(max(0.0, interval - (time.monotonic() - start)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.db is not None:
+                self.db.close()
+        print(f"Stopped, {len(self.scored)} units up to date")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="score the results of the LLMs as they are written")
+    parser.add_argument("--interval", type=float, default=2.0, help="the seconds between two polls of the results")
+    parser.add_argument("--debounce", type=float, default=5.0, help="the seconds the prediction files of a unit should be left untouched before it is scored")
+    parser.add_argument("--models", type=str, nargs="+", default=None, help="glob patterns of company/model to watch")
+    parser.add_argument("--input_type", type=str, nargs="+", default=None)
+    parser.add_argument("--exams", type=str, nargs="+", default=None, choices=list(TEST_TYPE_MAP))
+    parser.add_argument("--years", type=parse_years, default=None, help="e.g. 2024 or 2022-2024")
+    parser.add_argument("--fix_format", action="store_true")
+    parser.add_argument("--history_format", type=str, default="json", choices=HISTORY_FORMATS)
+    parser.add_argument("--export_json", action="store_true")
+    parser.add_argument("--sample", type=int, default=0)
+    parser.add_argument("--results_db", type=str, default=None, help="also update this SQLite results database, see results_db.py")
+    parser.add_argument("--exam_store", type=str, default=None)
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--res_dir", type=str, default="./results")
+    parser.add_argument("--score_dir", type=str, default="./scoring")
+    parser.add_argument("--data_dir", type=str, default="./exams/JA")
+    args = parser.parse_args()
+
+    watcher = ResultsWatcher(args.res_dir, args.score_dir, args.data_dir, cache_dir=args.cache_dir, exam_store=args.exam_store, fix_format=args.fix_format,
+                             history_format=args.history_format, export_json=args.export_json, sample=args.sample, results_db=args.results_db,
+                             debounce=args.debounce, models=args.models, input_types=args.input_type, exams=args.exams, years=args.years)
+    watcher.run(args.interval)